@@ -41,10 +41,12 @@ DEFINITION_TEMPLATES = {
 class PythonGeneratorCli(GeneratorCli):
     def build_parser(self, parser):
         self._add_module_args(parser)
+        parser.add_argument('--slots', action='store_true', default=False,
+                            help='generate messages with __slots__ instead of __dict__')
 
     def create_generator(self, out, args):
         module_names = self._parse_module_args(args)
-        return PythonGenerator(out, module_names)
+        return PythonGenerator(out, module_names, slots=args.slots)
 
 
 class PythonGenerator(Generator):
@@ -54,9 +56,10 @@ class PythonGenerator(Generator):
     def create_cli(cls):
         return PythonGeneratorCli()
 
-    def __init__(self, out, module_names=None):
+    def __init__(self, out, module_names=None, slots=False):
         super(PythonGenerator, self).__init__(out)
 
+        self.slots = slots
         self.module_mapper = ModuleMapper(module_names)
         self.filters = _PythonFilters(self.module_mapper)
         self.templates = Templates(__file__, filters=self.filters)
@@ -99,7 +102,7 @@ class PythonGenerator(Generator):
             if def0.is_enum:
                 return template.render(enum=def0)
             elif def0.is_message:
-                return template.render(message=def0)
+                return template.render(message=def0, slots=self.slots)
             else:
                 return template.render(interface=def0)
         finally:
@@ -144,6 +147,13 @@ class _PythonFilters(object):
             return self.pyref(message.base)
         return 'pdef.Exc' if message.is_exception else 'pdef.Message'
 
+    def pyslots(self, message):
+        names = [str('_' + field.name) for field in message.declared_fields]
+        if not message.base:
+            # The root message stores not yet decoded fields, see pdef.Message.
+            names.append(str('_pdef_lazy'))
+        return repr(tuple(names))
+
     def pybool(self, expr):
         return 'True' if expr else 'False'
 
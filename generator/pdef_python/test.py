@@ -44,6 +44,17 @@ class TestPythonGenerator(unittest.TestCase):
         code = generator._render_definition(msg)
         assert code
 
+    def test_render_message__slots(self):
+        base = Message('Base')
+        base.create_field('field0', NativeType.BOOL)
+
+        msg = Message('Message', base=base)
+        msg.create_field('field1', NativeType.INT32)
+
+        generator = PythonGenerator('/dev/null', slots=True)
+        assert "__slots__ = ('_field0', '_pdef_lazy')" in generator._render_definition(base)
+        assert "__slots__ = ('_field1',)" in generator._render_definition(msg)
+
     def test_render_enum(self):
         enum = Enum('Number')
         enum.create_value('ONE')
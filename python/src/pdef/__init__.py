@@ -16,8 +16,9 @@
 
 from pdef.types import Type, Message, Exc, Enum, Interface
 from pdef.invoke import proxy
-from pdef.formats import jsonformat
-from pdef.rpc import rpc_client, rpc_handler, wsgi_app
+from pdef.formats import jsonformat, binaryformat
+from pdef.rpc import rpc_client, async_rpc_client, http_pool, rpc_handler, wsgi_app, \
+    asgi_app
 from pdef.version import __version__
 
 __title__ = 'pdef'
@@ -0,0 +1,541 @@
+# encoding: utf-8
+'''Asyncio RPC client and ASGI server, require Python 3.5+.'''
+import asyncio
+import functools
+import http.client as http_codes
+import inspect
+import logging
+import ssl as _ssl
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode as _urlencode, urlsplit
+
+import pdef
+from pdef.rpc import RpcException, RpcProtocol, RpcRequest, parse_query, parse_response, \
+    rpc_result_class, rpc_result_classes, APPLICATION_JSON_CONTENT_TYPE, \
+    FORM_URLENCODED_MIME_TYPE, JSON_MIME_TYPE, POST, STREAM_THRESHOLD, \
+    TEXT_PLAIN_CONTENT_TYPE, UTF8
+
+HTTP_PORT = 80
+HTTPS_PORT = 443
+LATIN1 = 'latin-1'
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRpcClient(object):
+    '''Asyncio RPC client, its proxies return awaitables from terminal methods.
+
+    Arguments are serialized when a method is called, so they can be mutated
+    while a request is in flight.
+
+    @param transport:   An AsyncTransport, the default is StreamTransport.
+    '''
+
+    def __init__(self, interface, url, transport=None, protocol=None):
+        if not interface:
+            raise ValueError('Interface required')
+        if not url:
+            raise ValueError('Url required')
+
+        self.interface = interface
+        self.interface_descriptor = interface.descriptor
+
+        self.url = url
+        self.transport = transport or StreamTransport()
+        self.protocol = protocol or RpcProtocol()
+
+        # Create the result classes in advance.
+        rpc_result_classes(self.interface_descriptor)
+
+    def proxy(self, copy_args=True):
+        return pdef.proxy(self.interface, self, copy_args=copy_args)
+
+    def __call__(self, invocation):
+        '''Serialize an invocation and return a coroutine which sends it.'''
+        if not invocation:
+            raise ValueError('Invocation required')
+
+        rpc_request = self.protocol.get_request(invocation)
+
+        resultd = invocation.method.result
+        excd = self.interface_descriptor.exc
+
+        method, url, headers, body = self._build_request(rpc_request)
+        return self._send(method, url, headers, body, resultd, excd)
+
+    def _build_request(self, rpc_request):
+        '''Return a tuple (method, url, headers, body).'''
+        url = self.url + rpc_request.path
+        if rpc_request.query:
+            url += '?' + _urlencode(rpc_request.query)
+
+        headers = {}
+        body = None
+        if rpc_request.is_post:
+            headers['Content-Type'] = FORM_URLENCODED_MIME_TYPE
+            body = _urlencode(rpc_request.post).encode(UTF8)
+
+        return rpc_request.method, url, headers, body
+
+    async def map(self, invocations, max_concurrency=None):
+        '''Execute invocations concurrently and return a list of rpc results in their order.
+
+        Application exceptions are returned in the result errors and do not abort the batch.
+        Other exceptions are raised as in asyncio.gather.
+
+        @param max_concurrency: Max concurrent invocations or None.
+        '''
+        limit = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        return await asyncio.gather(*[self._invoke_result(inv, limit) for inv in invocations])
+
+    async def _invoke_result(self, invocation, limit=None):
+        excd = self.interface_descriptor.exc
+        result_class = rpc_result_class(invocation.method.result, excd)
+
+        try:
+            if limit is None:
+                data = await self(invocation)
+            else:
+                async with limit:
+                    data = await self(invocation)
+        except Exception as e:
+            if excd and isinstance(e, excd.pyclass):
+                return result_class(error=e)
+            raise
+
+        return result_class(data)
+
+    async def _send(self, method, url, headers, body, resultd, excd=None):
+        response = await self.transport.send(method, url, headers=headers, body=body)
+        result = parse_response(response, resultd, excd, jsonformat=self.protocol.jsonformat)
+
+        if result is None and resultd.is_primitive:
+            # Proxies return default primitive results only from synchronous handlers.
+            return resultd.default
+        return result
+
+    async def close(self):
+        '''Close the transport connections.'''
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class AsgiRpcApp(object):
+    '''ASGI RPC application, it supports async def and synchronous services.
+
+    Coroutine service methods are awaited on the event loop, synchronous ones are
+    executed in a bounded thread pool. Requests, batch requests and responses are
+    the same as in WsgiRpcApp, the requests of a batch are handled concurrently.
+
+    @param handler:             An RpcHandler.
+    @param max_workers:         Max threads of synchronous service methods.
+    @param executor:            A concurrent.futures executor for synchronous service methods,
+                                the default is a new thread pool.
+    @param max_batch_size:      Max requests in one batch.
+    @param indent:              JSON response indent, the default is compact JSON.
+    @param stream_threshold:    Min size of streamed collection results in bytes,
+                                None disables streaming.
+    '''
+
+    def __init__(self, handler, max_workers=10, executor=None, max_batch_size=1000,
+                 indent=None, stream_threshold=STREAM_THRESHOLD):
+        if not handler:
+            raise ValueError('Handler required')
+        self.handler = handler
+        self.protocol = handler.protocol
+        self.max_batch_size = max_batch_size
+        self.indent = indent
+        self.stream_threshold = stream_threshold
+
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+
+    async def __call__(self, scope, receive, send):
+        type0 = scope['type']
+        if type0 == 'lifespan':
+            return await self._lifespan(receive, send)
+        if type0 != 'http':
+            raise ValueError('Unsupported ASGI scope type %r' % type0)
+
+        body = await _read_asgi_body(receive)
+        method = scope['method']
+        path = scope['path']
+        ctype = ''
+        for name, value in scope.get('headers') or ():
+            if name.lower() == b'content-type':
+                ctype = value.decode(LATIN1).lower()
+
+        if method == POST and ctype.startswith(JSON_MIME_TYPE) and not path.strip('/'):
+            return await self.handle_batch(body, send)
+
+        query = _parse_params(scope.get('query_string', b'').decode(LATIN1))
+        post = {}
+        if method == POST and ctype.startswith(FORM_URLENCODED_MIME_TYPE):
+            post = _parse_params(body.decode(UTF8))
+
+        request = RpcRequest(method, path=path, query=query, post=post)
+        try:
+            success, result = await self.handle(request)
+        except RpcException as e:
+            status = e.status or http_codes.INTERNAL_SERVER_ERROR
+            content = e.message or 'Internal server error'
+            return await self._response(send, status, content)
+
+        status_code = http_codes.OK if success else http_codes.UNPROCESSABLE_ENTITY
+        if self.stream_threshold is not None and success \
+                and isinstance(result.data, (list, set, dict)):
+            return await self._stream_response(send, status_code, result)
+
+        content = self.protocol.jsonformat.write_bytes(result, result.descriptor,
+                                                       indent=self.indent, compact=True)
+        await self._response(send, status_code, content, APPLICATION_JSON_CONTENT_TYPE)
+
+    async def handle(self, rpc_request):
+        '''Handle an rpc request and return a tuple (is_successful, rpc_result).'''
+        handler = self.handler
+        invocation = handler.get_invocation(rpc_request)
+
+        try:
+            data = await self._invoke(invocation)
+            return True, handler.get_result(invocation, data)
+        except Exception as e:
+            if handler.is_application_exc(e):
+                return False, handler.get_result(invocation, error=e)
+            raise
+
+    async def handle_batch(self, body, send):
+        try:
+            requests0 = self.protocol.read_batch_request(body)
+        except ValueError:
+            return await self._response(send, http_codes.BAD_REQUEST, 'Malformed batch request')
+
+        if len(requests0) > self.max_batch_size:
+            return await self._response(send, http_codes.REQUEST_ENTITY_TOO_LARGE,
+                                        'Too many requests in a batch, max %s'
+                                        % self.max_batch_size)
+
+        results = await asyncio.gather(*[self._handle_batch_item(r) for r in requests0])
+        content = self.protocol.write_batch_response(results, indent=self.indent)
+        await self._response(send, http_codes.OK, content, APPLICATION_JSON_CONTENT_TYPE)
+
+    def close(self):
+        '''Shut down the thread pool when it is owned by the app.'''
+        if self._owns_executor:
+            self.executor.shutdown(wait=False)
+
+    async def _handle_batch_item(self, request):
+        '''Return a tuple (status, rpc_result or error message), never raise.'''
+        try:
+            success, result = await self.handle(request)
+        except RpcException as e:
+            return e.status or http_codes.INTERNAL_SERVER_ERROR, \
+                e.message or 'Internal server error'
+        except Exception:
+            # Do not abort the other requests in the batch.
+            logger.exception('Failed to handle a batch request %s', request)
+            return http_codes.INTERNAL_SERVER_ERROR, 'Internal server error'
+
+        return (http_codes.OK if success else http_codes.UNPROCESSABLE_ENTITY), result
+
+    async def _invoke(self, invocation):
+        '''Invoke a chain on the service, await coroutine methods and offload the others.'''
+        loop = asyncio.get_event_loop()
+        obj = self.handler.service
+
+        for inv in invocation.to_chain():
+            method = inv.method
+            kwargs = inv.kwargs_with_default_primitives
+
+            if inspect.iscoroutinefunction(getattr(obj, method.name, None)):
+                obj = method.invoke(obj, **kwargs)
+            else:
+                call = functools.partial(method.invoke, obj, **kwargs)
+                obj = await loop.run_in_executor(self.executor, call)
+
+            if inspect.isawaitable(obj):
+                obj = await obj
+
+        return obj
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _stream_response(self, send, status_code, result):
+        '''Encode a result incrementally, send a usual response when it is below
+        the stream threshold, or send the buffered and the remaining chunks.'''
+        chunks = self.protocol.jsonformat.iter_bytes(result, result.descriptor,
+                                                     indent=self.indent, compact=True)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size > self.stream_threshold:
+                break
+        else:
+            return await self._response(send, status_code, b''.join(head),
+                                        APPLICATION_JSON_CONTENT_TYPE)
+
+        await send({'type': 'http.response.start', 'status': status_code,
+                    'headers': [(b'content-type', APPLICATION_JSON_CONTENT_TYPE.encode(LATIN1))]})
+        for chunk in head:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _response(self, send, status_code, content, content_type=TEXT_PLAIN_CONTENT_TYPE):
+        if not isinstance(content, bytes):
+            content = content.encode(UTF8)
+
+        headers = [(b'content-type', content_type.encode(LATIN1)),
+                   (b'content-length', str(len(content)).encode(LATIN1))]
+        await send({'type': 'http.response.start', 'status': status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+
+async def _read_asgi_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _parse_params(s):
+    return {key: values[0] if values else '' for key, values in parse_query(s).items()}
+
+
+class HttpResponse(object):
+    '''HTTP response with a status code, lowercase header names and a bytes content.'''
+
+    def __init__(self, status_code, headers=None, content=b''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+    def __repr__(self):
+        return '<HttpResponse %s>' % self.status_code
+
+    @property
+    def text(self):
+        '''Return the content decoded from UTF-8.'''
+        return self.content.decode(UTF8, 'replace')
+
+
+class AsyncTransport(object):
+    '''Async HTTP transport interface.'''
+
+    async def send(self, method, url, headers=None, body=None):
+        '''Send an HTTP request and return an HttpResponse.'''
+        raise NotImplementedError
+
+    async def close(self):
+        '''Close all connections.'''
+        pass
+
+
+class StreamTransport(AsyncTransport):
+    '''Default HTTP/1.1 transport based on asyncio streams.
+
+    It keeps connections alive and reuses them for the next requests to the same host.
+    Connections which have been closed by a server while idle are replaced transparently.
+
+    @param max_idle:        Max idle connections per host.
+    @param max_connections: Max concurrent connections per host or None.
+    @param timeout:         Request timeout in seconds or None.
+    @param ssl_context:     An SSL context for https urls, the default is a default context.
+    '''
+
+    def __init__(self, max_idle=10, max_connections=None, timeout=None, ssl_context=None):
+        self.max_idle = max_idle
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+
+        self._idle = {}     # (scheme, host, port): [(reader, writer), ...]
+        self._limits = {}   # (scheme, host, port): asyncio.Semaphore
+
+    async def send(self, method, url, headers=None, body=None):
+        if self.timeout is None:
+            return await self._send(method, url, headers, body)
+
+        return await asyncio.wait_for(self._send(method, url, headers, body), self.timeout)
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+
+    async def _send(self, method, url, headers, body):
+        parts = urlsplit(url)
+        https = parts.scheme == 'https'
+        port = parts.port or (HTTPS_PORT if https else HTTP_PORT)
+        key = (parts.scheme, parts.hostname, port)
+
+        target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        host = parts.netloc.rpartition('@')[2]
+        request = _encode_request(method, target, host, headers, body)
+
+        limit = self._limit(key)
+        if limit is None:
+            return await self._exchange(key, request, method, https)
+
+        async with limit:
+            return await self._exchange(key, request, method, https)
+
+    async def _exchange(self, key, request, method, https):
+        conn = self._acquire(key)
+        if conn is not None:
+            try:
+                response, keep_alive = await self._roundtrip(conn, request, method)
+            except _StaleConnection:
+                # The server has closed the idle connection, retry with a new one.
+                conn[1].close()
+                conn = None
+            except BaseException:
+                conn[1].close()
+                raise
+
+        if conn is None:
+            _, host, port = key
+            ssl = (self.ssl_context or _ssl.create_default_context()) if https else None
+            conn = await asyncio.open_connection(host, port, ssl=ssl)
+            try:
+                response, keep_alive = await self._roundtrip(conn, request, method)
+            except BaseException:
+                conn[1].close()
+                raise
+
+        if keep_alive:
+            self._release(key, conn)
+        else:
+            conn[1].close()
+        return response
+
+    async def _roundtrip(self, conn, request, method):
+        '''Write a request and read a response, return a tuple (response, keep_alive).'''
+        reader, writer = conn
+        try:
+            writer.write(request)
+            await writer.drain()
+            line = await reader.readline()
+        except (ConnectionResetError, BrokenPipeError):
+            raise _StaleConnection()
+
+        if not line:
+            raise _StaleConnection()
+
+        version, status, _ = (line.decode(LATIN1).rstrip('\r\n') + ' ').split(' ', 2)
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            name, _, value = line.decode(LATIN1).partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            content = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            content = await _read_chunked(reader)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            # The content ends when the server closes the connection.
+            content = await reader.read()
+            keep_alive = False
+
+        return HttpResponse(status, headers, content), keep_alive
+
+    def _limit(self, key):
+        if self.max_connections is None:
+            return None
+
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits.setdefault(key, asyncio.Semaphore(self.max_connections))
+        return limit
+
+    def _acquire(self, key):
+        connections = self._idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            if not writer.transport.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    def _release(self, key, conn):
+        connections = self._idle.setdefault(key, [])
+        if len(connections) < self.max_idle:
+            connections.append(conn)
+        else:
+            conn[1].close()
+
+
+class _StaleConnection(Exception):
+    '''Raised when a reused connection is closed before a response.'''
+
+
+def _encode_request(method, target, host, headers, body):
+    lines = ['%s %s HTTP/1.1' % (method, target),
+             'Host: %s' % host,
+             'Connection: keep-alive',
+             'Accept-Encoding: identity']
+    if headers:
+        lines.extend('%s: %s' % (name, value) for name, value in headers.items())
+
+    body = body or b''
+    if body or method == 'POST':
+        lines.append('Content-Length: %d' % len(body))
+
+    lines.append('\r\n')
+    return '\r\n'.join(lines).encode(LATIN1) + body
+
+
+async def _read_chunked(reader):
+    chunks = []
+    while True:
+        line = await reader.readline()
+        size = int(line.split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            break
+
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+    # Skip trailers.
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+
+    return b''.join(chunks)
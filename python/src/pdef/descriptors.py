@@ -1,5 +1,6 @@
 # encoding: utf-8
 from datetime import datetime as _datetime
+import inspect
 import warnings
 
 from pdef import Type
@@ -15,13 +16,30 @@ except NameError:
     _string = str
 
 
+class _cached_property(object):
+    '''Non-data descriptor which computes a value on the first access and stores it
+    in the instance dict, so the next accesses are plain attribute lookups.'''
+
+    def __init__(self, method):
+        self.method = method
+        self.name = method.__name__
+        self.__doc__ = method.__doc__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+
+        value = self.method(obj)
+        obj.__dict__[self.name] = value
+        return value
+
+
 class Descriptor(object):
     '''Base type descriptor.'''
 
     def __init__(self, type0, pyclass):
         self.type = type0
         self._pyclass_supplier = _supplier(pyclass)
-        self._pyclass = None
 
         self.is_primitive = self.type in Type.PRIMITIVE_TYPES
         self.is_data_type = self.type in Type.DATA_TYPES
@@ -31,14 +49,14 @@ class Descriptor(object):
     def __str__(self):
         return str(self.type)
 
-    @property
+    @_cached_property
     def pyclass(self):
-        pyclass = self._pyclass
-        if pyclass:
-            return pyclass
+        return self._pyclass_supplier()
 
-        self._pyclass = self._pyclass_supplier()
-        return self._pyclass
+    def _freeze(self):
+        '''Resolve lazy attributes and return referenced descriptors, see freeze.'''
+        _ = self.pyclass
+        return ()
 
 
 class DataTypeDescriptor(Descriptor):
@@ -47,6 +65,10 @@ class DataTypeDescriptor(Descriptor):
     def __init__(self, type0, pyclass):
         super(DataTypeDescriptor, self).__init__(type0, pyclass)
 
+    def deepcopy(self, value, memo=None):
+        '''Return a deep copy of a value, immutable values are returned as they are.'''
+        return value
+
 
 class MessageDescriptor(DataTypeDescriptor):
     '''Message descriptor.'''
@@ -58,14 +80,12 @@ class MessageDescriptor(DataTypeDescriptor):
         self.declared_fields = tuple(fields) if fields else ()
         self.inherited_fields = base.fields if base else ()
         self.fields = self.inherited_fields + self.declared_fields
-        self._field_tuples = None
+        self._field_map = _name_map(self.fields)
 
         self.discriminator_value = discriminator_value
         self.discriminator = self._find_discriminator(self.fields)
 
         self._subtype_suppliers = tuple(_supplier(s) for s in subtypes) if subtypes else ()
-        self._subtypes = None
-        self._subtype_map = None
 
         self.is_polymorphic = bool(self.discriminator)
 
@@ -82,39 +102,45 @@ class MessageDescriptor(DataTypeDescriptor):
             if field.is_discriminator:
                 return field
 
-    @property
+    @_cached_property
     def subtypes(self):
-        subtypes = self._subtypes
-        if subtypes:
-            return subtypes
+        return tuple(supplier() for supplier in self._subtype_suppliers)
 
-        self._subtypes = tuple(supplier() for supplier in self._subtype_suppliers)
-        self._subtype_map = {s.discriminator_value: s for s in self._subtypes}
-        return self._subtypes
+    @_cached_property
+    def _subtype_map(self):
+        return {s.discriminator_value: s for s in self.subtypes}
 
-    @property
+    @_cached_property
     def field_tuples(self):
-        field_tuples = self._field_tuples
-        if field_tuples:
-            return field_tuples
+        return tuple((field.name, field.private_name, field.type) for field in self.fields)
 
-        self._field_tuples = tuple((field.name, field.private_name, field.type)
-                                   for field in self.fields)
-        return self._field_tuples
+    @_cached_property
+    def mutable_field_tuples(self):
+        '''Return (private_name, type) tuples of collection and message fields.'''
+        return tuple((field.private_name, field.type) for field in self.fields
+                     if field.type.is_mutable)
+
+    def deepcopy(self, value, memo=None):
+        return None if value is None else value.__deepcopy__(memo)
 
     def find_field(self, name):
         '''Return a field by its name or None.'''
-        for field in self.fields:
-            if field.name == name:
-                return field
+        return self._field_map.get(name)
 
     def find_subtype(self, type0):
         '''Return a subtype descriptor by a type enum value or self if not found.'''
-        _ = self.subtypes  # Force loading subtypes.
-
         subtype = self._subtype_map.get(type0)
         return subtype if subtype else self
 
+    def _freeze(self):
+        _ = self.pyclass, self._subtype_map, self.field_tuples, self.mutable_field_tuples
+
+        refs = [field.type for field in self.declared_fields]
+        refs.extend(self.subtypes)
+        if self.base:
+            refs.append(self.base)
+        return refs
+
 
 class FieldDescriptor(object):
     '''Message field descriptor which provides a field meta-data and implements the python
@@ -153,21 +179,15 @@ class FieldDescriptor(object):
         self.private_name = '_' + name
 
         self._type_supplier = _supplier(type0)
-        self._type = None
         self.is_discriminator = is_discriminator
 
     def __str__(self):
         return self.name + ' ' + self.type
 
-    @property
+    @_cached_property
     def type(self):
         '''Return field type descriptor.'''
-        type0 = self._type
-        if type0:
-            return type0
-
-        self._type = self._type_supplier()
-        return self._type
+        return self._type_supplier()
 
     def __get__(self, message, owner=None):
         '''Get this field value in a message, check the type of the value.'''
@@ -180,6 +200,13 @@ class FieldDescriptor(object):
         if value is not None:
             return value
 
+        lazy = getattr(message, '_pdef_lazy', None)
+        if lazy is not None:
+            # Decode the field on the first access, see JsonFormat.read(lazy=True).
+            value = lazy.decode(message, self.name)
+            if value is not None:
+                return value
+
         default = self.type.default
         if self.type.is_mutable:
             setattr(message, self.private_name, default)
@@ -190,10 +217,19 @@ class FieldDescriptor(object):
         '''Set this field in a message to a value, check the type of the value.'''
         setattr(message, self.private_name, value)
 
+        lazy = getattr(message, '_pdef_lazy', None)
+        if lazy is not None:
+            # Drop a not yet decoded value, it has been replaced.
+            lazy.discard(message, self.name)
+
     def __has__(self, message):
         '''Return True if this field is not None is a message.'''
         value = getattr(message, self.private_name)
-        return value is not None
+        if value is not None:
+            return True
+
+        lazy = getattr(message, '_pdef_lazy', None)
+        return lazy is not None and lazy.has(self.name)
 
     @property
     def has_property(self):
@@ -207,27 +243,39 @@ class InterfaceDescriptor(Descriptor):
         super(InterfaceDescriptor, self).__init__(Type.INTERFACE, pyclass)
         self.base = base
         self._exc_supplier = _supplier(exc)
-        self._exc = None
 
         self.declared_methods = tuple(methods) if methods else ()
         self.inherited_methods = base.methods if base else ()
         self.methods = self.inherited_methods + self.declared_methods
+        self._method_map = _name_map(self.methods)
 
     def __str__(self):
         return str(self.pyclass)
 
-    @property
+    @_cached_property
     def exc(self):
-        if self._exc is None:
-            self._exc = self._exc_supplier() if self._exc_supplier else None
-
-        return self._exc or (self.base.exc if self.base else None)
+        exc = self._exc_supplier() if self._exc_supplier else None
+        return exc or (self.base.exc if self.base else None)
 
     def find_method(self, name):
         '''Return a method by its name or None.'''
-        for method in self.methods:
-            if method.name == name:
-                return method
+        return self._method_map.get(name)
+
+    def _freeze(self):
+        _ = self.pyclass
+
+        refs = []
+        for method in self.declared_methods:
+            refs.append(method.result)
+            refs.extend(arg.type for arg in method.args)
+            _ = method.is_terminal, method.is_interface, method.primitive_defaults, \
+                method.mutable_args
+
+        if self.exc:
+            refs.append(self.exc)
+        if self.base:
+            refs.append(self.base)
+        return refs
 
 
 class MethodDescriptor(object):
@@ -236,30 +284,73 @@ class MethodDescriptor(object):
     def __init__(self, name, result, args=None, is_post=False):
         self.name = name
         self._result_supplier = _supplier(result)
-        self._result = None
         self.args = tuple(args) if args else ()
+        self.arg_names = tuple(arg.name for arg in self.args)
+        self._arg_indexes = {name: i for i, name in enumerate(self.arg_names)}
 
         self.is_post = is_post
 
-    @property
+    @_cached_property
     def result(self):
         '''Return a result descriptor.'''
-        result = self._result
-        if result:
-            return result
-
-        self._result = self._result_supplier()
-        return self._result
+        return self._result_supplier()
 
-    @property
+    @_cached_property
     def is_terminal(self):
         '''Method is terminal when its result is not an interface.'''
         return self.result.type != Type.INTERFACE
-    
-    @property
+
+    @_cached_property
     def is_interface(self):
         return not self.is_terminal
 
+    @_cached_property
+    def primitive_defaults(self):
+        '''Return (name, default) tuples of primitive args.'''
+        return tuple((arg.name, arg.type.default) for arg in self.args if arg.type.is_primitive)
+
+    @_cached_property
+    def mutable_args(self):
+        '''Return (name, type) tuples of collection and message args.'''
+        return tuple((arg.name, arg.type) for arg in self.args if arg.type.is_mutable)
+
+    def bind(self, args=None, kwargs=None):
+        '''Convert args and kwargs into a dict of all method args, absent args are None.
+
+        @raise TypeError: when there are too many, unknown or duplicate arguments.
+        '''
+        names = self.arg_names
+        params = dict.fromkeys(names)
+
+        if args:
+            if len(args) > len(names):
+                raise self._wrong_args(args, kwargs)
+            params.update(zip(names, args))
+
+        if kwargs:
+            indexes = self._arg_indexes
+            npositional = len(args) if args else 0
+            for name, value in kwargs.items():
+                index = indexes.get(name)
+                if index is None or index < npositional:
+                    raise self._wrong_args(args, kwargs)
+                params[name] = value
+
+        return params
+
+    def with_default_primitives(self, kwargs):
+        '''Return a copy of bound kwargs where None primitive args are replaced
+        with their default values.'''
+        result = dict(kwargs)
+        for name, default in self.primitive_defaults:
+            if result.get(name) is None:
+                result[name] = default
+        return result
+
+    def _wrong_args(self, args, kwargs):
+        return TypeError('Wrong method arguments, %s, got args=%s, kwargs=%s' %
+                         (self, args, kwargs))
+
     def invoke(self, obj, *args, **kwargs):
         '''Invoke this method on an object with a given arguments, return the result'''
         return getattr(obj, self.name)(*args, **kwargs)
@@ -289,7 +380,6 @@ class ArgDescriptor(object):
         '''Create an argument descriptor, is_query and is_post are deprecated.'''
         self.name = name
         self._type_supplier = _supplier(type0)
-        self._type = None
 
         self.is_query = is_query
         self.is_post = is_post
@@ -297,15 +387,10 @@ class ArgDescriptor(object):
         if is_query or is_post:
             warnings.warn(DeprecationWarning('Argument query and post flags are deprecated'))
 
-    @property
+    @_cached_property
     def type(self):
         '''Return argument type descriptor.'''
-        type0 = self._type
-        if type0:
-            return type0
-
-        self._type = self._type_supplier()
-        return self._type
+        return self._type_supplier()
 
 
 class EnumDescriptor(DataTypeDescriptor):
@@ -315,6 +400,10 @@ class EnumDescriptor(DataTypeDescriptor):
         super(EnumDescriptor, self).__init__(Type.ENUM, pyclass)
         self.values = tuple(v.upper() for v in values)
 
+        # Map values and their lower case forms, the other forms are uppercased on lookup.
+        self._value_map = {v: v for v in self.values}
+        self._value_map.update((v.lower(), v) for v in self.values)
+
     @property
     def default(self):
         return self.values[0]
@@ -322,11 +411,11 @@ class EnumDescriptor(DataTypeDescriptor):
     def find_value(self, name):
         if name is None:
             return None
-        name = name.upper()
 
-        if name not in self.values:
-            return None
-        return name
+        value = self._value_map.get(name)
+        if value is not None:
+            return value
+        return self._value_map.get(name.upper())
 
 
 class ListDescriptor(DataTypeDescriptor):
@@ -343,6 +432,20 @@ class ListDescriptor(DataTypeDescriptor):
     def default(self):
         return []
 
+    def deepcopy(self, value, memo=None):
+        if value is None:
+            return None
+
+        element = self.element
+        if not element.is_mutable:
+            return list(value)
+
+        copy = element.deepcopy
+        return [copy(elem, memo) for elem in value]
+
+    def _freeze(self):
+        return self.element,
+
 
 class SetDescriptor(DataTypeDescriptor):
     '''Internal set descriptor.'''
@@ -358,6 +461,20 @@ class SetDescriptor(DataTypeDescriptor):
     def default(self):
         return set()
 
+    def deepcopy(self, value, memo=None):
+        if value is None:
+            return None
+
+        element = self.element
+        if not element.is_mutable:
+            return set(value)
+
+        copy = element.deepcopy
+        return {copy(elem, memo) for elem in value}
+
+    def _freeze(self):
+        return self.element,
+
 
 class MapDescriptor(DataTypeDescriptor):
     '''Internal map/dict descriptor.'''
@@ -374,6 +491,21 @@ class MapDescriptor(DataTypeDescriptor):
     def default(self):
         return {}
 
+    def deepcopy(self, value, memo=None):
+        if value is None:
+            return None
+
+        # Keys are always immutable.
+        valued = self.value
+        if not valued.is_mutable:
+            return dict(value)
+
+        copy = valued.deepcopy
+        return {k: copy(v, memo) for k, v in value.items()}
+
+    def _freeze(self):
+        return self.key, self.value
+
 
 class _PrimitiveDescriptor(DataTypeDescriptor):
     def __init__(self, type0, pyclass, default):
@@ -427,6 +559,41 @@ def arg(name, type0, is_query=False, is_post=False):
     return ArgDescriptor(name, type0, is_query=is_query, is_post=is_post)
 
 
+def freeze(obj):
+    '''Resolve lazy attributes of all descriptors reachable from a generated module,
+    a pdef class or a descriptor, and return the object.
+
+    Descriptors resolve types, classes and subtypes lazily on the first access and then
+    keep them as plain attributes. Freeze pays this cost up front, i.e. on a worker startup.
+    '''
+    if inspect.ismodule(obj):
+        roots = list(vars(obj).values())
+    else:
+        roots = [obj]
+
+    roots = [getattr(root, 'descriptor', None) if inspect.isclass(root) else root
+             for root in roots]
+
+    stack = [d for d in roots if isinstance(d, Descriptor)]
+    seen = set()
+    while stack:
+        descriptor = stack.pop()
+        if descriptor in seen:
+            continue
+
+        seen.add(descriptor)
+        stack.extend(descriptor._freeze())
+    return obj
+
+
+def _name_map(members):
+    '''Return a dict of members by their names, the first member wins on a name clash.'''
+    result = {}
+    for member in members:
+        result.setdefault(member.name, member)
+    return result
+
+
 def _supplier(type_or_lambda):
     if _is_lambda(type_or_lambda):
         # It is already a supplier.
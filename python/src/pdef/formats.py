@@ -1,199 +1,1487 @@
 # encoding: utf-8
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import codecs
 import json as _json
+import re
+import struct
+import sys
+import threading
+import weakref
 import pdef.types
 
+try:
+    # Python 2.7
+    _string_types = basestring
+except NameError:
+    # Python 3
+    _string_types = str
+
 SIMPLE_ISO_8601_PATTERN = "%Y-%m-%dT%H:%M:%SZ"
+DATETIME_CACHE_SIZE = 1024
+STREAM_BUFFER_SIZE = 64 * 1024
+UTF8 = 'utf-8'
+_PY2 = sys.version_info[0] == 2
 
 
 class JsonFormat(object):
-    '''JsonFormat parses/serializes Pdef types from/to JSON.'''
+    '''JsonFormat parses/serializes Pdef types from/to JSON.
 
-    def __init__(self):
+    @param backend: A JsonBackend or a backend name (stdlib, orjson or auto),
+                    None is the stdlib json module.
+    '''
+
+    def __init__(self, backend=None, buffer_size=STREAM_BUFFER_SIZE):
+        self.backend = json_backend(backend) if not isinstance(backend, JsonBackend) else backend
         self.object_format = _JsonObjectFormat()
+        self.buffer_size = buffer_size
+        self._stream_encoders = {}
 
-    def read(self, s, descriptor):
-        '''Read a pdef object from a JSON string.'''
+    def read(self, s, descriptor, lazy=False):
+        '''Read a pdef object from a JSON string.
+
+        @param lazy:    When True, message fields are kept as parsed JSON values and decoded
+                        on the first access, untouched fields are written back as they are.
+        '''
         if s is None:
             return None
 
-        value = _json.loads(s)
-        parsed = self.object_format.read(value, descriptor)
+        value = self.backend.loads(s)
+        parsed = self.object_format.read(value, descriptor, lazy=lazy)
         return parsed
 
-    def read_stream(self, fp, descriptor):
+    def read_bytes(self, b, descriptor, lazy=False):
+        '''Read a pdef object from UTF-8 JSON bytes.'''
+        if b is None:
+            return None
+
+        value = self.backend.loads_bytes(b)
+        return self.object_format.read(value, descriptor, lazy=lazy)
+
+    def read_stream(self, fp, descriptor, lazy=False):
         '''Read a pdef object from a a JSON file-like object.'''
-        value = _json.load(fp)
-        parsed = self.object_format.read(value, descriptor)
+        s = fp.read()
+        value = self.backend.loads_bytes(s) if isinstance(s, bytes) else self.backend.loads(s)
+        parsed = self.object_format.read(value, descriptor, lazy=lazy)
         return parsed
 
-    def read_object(self, data, descriptor):
+    def iter_stream(self, fp, descriptor, lazy=False):
+        '''Incrementally read a JSON array from a file-like object and yield its parsed elements.
+
+        @param descriptor:  A list or set descriptor.
+        '''
+        Type = pdef.types.Type
+        if descriptor.type not in (Type.LIST, Type.SET):
+            raise ValueError('List or set descriptor required, got %s' % descriptor)
+
+        read = self.object_format.read
+        elemd = descriptor.element
+        return (read(elem, elemd, lazy=lazy) for elem in _JsonArrayReader(fp, self.buffer_size))
+
+    def read_object(self, data, descriptor, lazy=False):
         '''Read a pdef object from a JSON-compatible object.'''
-        return self.object_format.read(data, descriptor)
+        return self.object_format.read(data, descriptor, lazy=lazy)
 
     def write(self, obj, descriptor, indent=None, **kwargs):
         '''Write a pdef object to a JSON string.'''
-        serialized = self.object_format.write(obj, descriptor)
-        s = _json.dumps(serialized, ensure_ascii=False, indent=indent, **kwargs)
+        serialized = self.object_format.write(obj, descriptor, copy=False)
+        s = self.backend.dumps(serialized, indent=indent, **kwargs)
         return s
 
+    def write_bytes(self, obj, descriptor, indent=None, compact=False, **kwargs):
+        '''Write a pdef object to UTF-8 JSON bytes.
+
+        @param compact: When True and there is no indent, the JSON has no whitespace
+                        between tokens.
+        '''
+        serialized = self.object_format.write(obj, descriptor, copy=False)
+        if compact and indent is None and not kwargs:
+            return self.backend.dumps_compact_bytes(serialized)
+        return self.backend.dumps_bytes(serialized, indent=indent, **kwargs)
+
     def write_to_stream(self, obj, descriptor, fp, indent=None, **kwargs):
-        '''Write a pdef object as a JSON string to a file-like object.'''
-        serialized = self.object_format.write(obj, descriptor)
-        return _json.dump(serialized, fp, ensure_ascii=False, indent=indent, **kwargs)
+        '''Write a pdef object as a JSON string to a file-like object.
+
+        The object is encoded incrementally and written in chunks of about buffer_size
+        characters. Custom json.dump kwargs fall back to encoding a JSON-compatible object.
+        '''
+        if kwargs:
+            fp.write(self.write(obj, descriptor, indent=indent, **kwargs))
+            return
+
+        buffer_size = self.buffer_size
+        buf = []
+        size = 0
+        for chunk in self.iter_json(obj, descriptor, indent=indent):
+            buf.append(chunk)
+            size += len(chunk)
+
+            if size >= buffer_size:
+                fp.write(''.join(buf))
+                buf = []
+                size = 0
+
+        if buf:
+            fp.write(''.join(buf))
+
+    def iter_json(self, obj, descriptor, indent=None, compact=False):
+        '''Return a generator which incrementally encodes a pdef object into JSON text chunks.
+
+        @param compact: When True and there is no indent, the JSON has no whitespace
+                        between tokens.
+        '''
+        key = (indent, compact and indent is None)
+        encoder = self._stream_encoders.get(key)
+        if encoder is None:
+            encoder = self._stream_encoders.setdefault(key, _JsonStreamEncoder(*key))
+
+        return encoder.iterencode(obj, descriptor)
+
+    def iter_bytes(self, obj, descriptor, indent=None, compact=False):
+        '''Return a generator which incrementally encodes a pdef object into UTF-8 JSON chunks
+        of about buffer_size bytes.'''
+        buffer_size = self.buffer_size
+        buf = []
+        size = 0
+        for chunk in self.iter_json(obj, descriptor, indent=indent, compact=compact):
+            buf.append(chunk)
+            size += len(chunk)
+
+            if size >= buffer_size:
+                yield ''.join(buf).encode(UTF8)
+                buf = []
+                size = 0
+
+        if buf:
+            yield ''.join(buf).encode(UTF8)
 
     def write_object(self, obj, descriptor):
         '''Write a pdef object into a JSON-compatible object.'''
         return self.object_format.write(obj, descriptor)
 
 
+class JsonBackend(object):
+    '''JSON backend interface, it converts JSON-compatible objects from/to JSON strings and bytes.
+
+    Subclasses must implement loads and dumps, the bytes methods by default go through strings.
+    '''
+    name = None
+
+    def loads(self, s):
+        '''Parse a JSON string or UTF-8 bytes.'''
+        raise NotImplementedError
+
+    def dumps(self, obj, indent=None, **kwargs):
+        '''Serialize an object into a JSON string.'''
+        raise NotImplementedError
+
+    def loads_bytes(self, b):
+        '''Parse UTF-8 JSON bytes.'''
+        return self.loads(b.decode(UTF8))
+
+    def dumps_bytes(self, obj, indent=None, **kwargs):
+        '''Serialize an object into UTF-8 JSON bytes.'''
+        return self.dumps(obj, indent=indent, **kwargs).encode(UTF8)
+
+    def dumps_compact_bytes(self, obj):
+        '''Serialize an object into UTF-8 JSON bytes without insignificant whitespace.'''
+        return self.dumps_bytes(obj)
+
+
+class StdlibJsonBackend(JsonBackend):
+    '''Default JSON backend based on the built-in json module.'''
+    name = 'stdlib'
+
+    def loads(self, s):
+        return _json.loads(s)
+
+    def dumps(self, obj, indent=None, **kwargs):
+        return _json.dumps(obj, ensure_ascii=False, indent=indent, **kwargs)
+
+    def dumps_compact_bytes(self, obj):
+        return _compact_encoder.encode(obj).encode(UTF8)
+
+    if sys.version_info >= (3, 6) or _PY2:
+        # The json module detects the encoding of bytes itself.
+        def loads_bytes(self, b):
+            return _json.loads(b)
+
+
+class OrjsonBackend(JsonBackend):
+    '''Fast JSON backend based on orjson, it writes compact JSON and supports only 2-space indents.'''
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, s):
+        return self._orjson.loads(s)
+
+    def loads_bytes(self, b):
+        return self._orjson.loads(b)
+
+    def dumps(self, obj, indent=None, **kwargs):
+        return self.dumps_bytes(obj, indent=indent, **kwargs).decode(UTF8)
+
+    def dumps_bytes(self, obj, indent=None, **kwargs):
+        if kwargs:
+            raise TypeError('Unsupported orjson kwargs %s' % ', '.join(kwargs))
+
+        orjson = self._orjson
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+
+def json_backend(name=None):
+    '''Return a JSON backend by its name, None returns the stdlib backend,
+    "auto" returns the fastest installed backend.'''
+    if name is None or name == StdlibJsonBackend.name:
+        return StdlibJsonBackend()
+
+    elif name == OrjsonBackend.name:
+        return OrjsonBackend()
+
+    elif name == 'auto':
+        try:
+            return OrjsonBackend()
+        except ImportError:
+            return StdlibJsonBackend()
+
+    raise ValueError('Unknown JSON backend %r' % name)
+
+
 class _JsonObjectFormat(object):
-    '''JsonObjectFormat parses/serializes Pdef objects from/to JSON-compatible objects.'''
+    '''JsonObjectFormat parses/serializes Pdef objects from/to JSON-compatible objects.
 
-    def write(self, obj, descriptor):
-        '''Write an object to a native python type.'''
+    Readers and writers are compiled for each descriptor on its first use and cached,
+    so collections and messages are converted without a per-value type dispatch.
+
+    Lazy readers create messages which keep their JSON field values and decode them
+    on the first access, see _LazyFields.
+    '''
+
+    def __init__(self):
+        self._readers = _CodecCache(self._compile_reader)
+        self._lazy_readers = _CodecCache(lambda descriptor: self._compile_reader(descriptor, True))
+        self._writers = _CodecCache(self._compile_writer)
+        self._shared_writers = _CodecCache(
+            lambda descriptor: self._compile_writer(descriptor, False))
+
+    def write(self, obj, descriptor, copy=True):
+        '''Write an object to a native python type.
+
+        @param copy: When False, not decoded JSON values of lazy messages are returned
+                     without copying, use it only when the result is serialized immediately.
+        '''
         if obj is None:
             return None
 
+        writers = self._writers if copy else self._shared_writers
+        return writers.get(descriptor)(obj)
+
+    def read(self, data, descriptor, lazy=False):
+        '''Read a pdef object from a native python type.'''
+        if data is None:
+            return None
+
+        readers = self._lazy_readers if lazy else self._readers
+        return readers.get(descriptor)(data)
+
+    # Writers.
+
+    def _compile_writer(self, descriptor, copy=True):
         type0 = descriptor.type
-        if type0 in pdef.types.Type.PRIMITIVE_TYPES:
+        Type = pdef.types.Type
+
+        if type0 in Type.PRIMITIVE_TYPES:
             # This is for type checks.
-            return descriptor.pyclass(obj)
+            return descriptor.pyclass
+
+        elif type0 == Type.DATETIME:
+            return _write_datetime
+
+        elif type0 == Type.ENUM:
+            return _write_enum
+
+        writers = self._writers if copy else self._shared_writers
+        if type0 in (Type.LIST, Type.SET):
+            return self._list_writer(descriptor, writers)
+
+        elif type0 == Type.MAP:
+            return self._map_writer(descriptor, writers)
+
+        elif type0 == Type.MESSAGE:
+            return self._message_writer(descriptor, writers, copy)
+
+        elif type0 == Type.VOID:
+            return _none
+
+        raise ValueError('Unsupported type %s' % descriptor)
+
+    def _list_writer(self, descriptor, writers):
+        write = writers.get(descriptor.element)
+
+        def write_list(obj):
+            return [None if elem is None else write(elem) for elem in obj]
+        return write_list
+
+    def _map_writer(self, descriptor, writers):
+        write_key = _key_writer(descriptor.key)
+        write = writers.get(descriptor.value)
+
+        def write_map(obj):
+            return {write_key(k): None if v is None else write(v)
+                    for k, v in obj.items() if k is not None}
+        return write_map
+
+    def _message_writer(self, descriptor, writers, copy):
+        owner = weakref.proxy(self)
+        copy_raw = _copy_json if copy else None
+        fields = []
 
-        write = self.write
-        write_key = self._write_key
+        def write_message(message):
+            if message.descriptor is not descriptor:
+                # Support polymorphic messages.
+                return owner.write(message, message.descriptor, copy=copy)
+
+            result = {}
+            lazy = getattr(message, '_pdef_lazy', None)
+            for name, private_name, write in fields:
+                value = getattr(message, private_name)
+                if value is None:
+                    if lazy is not None and lazy.has(name):
+                        # Write back a not decoded JSON value, copy it when the result
+                        # is returned to a user, the value is shared with the message.
+                        raw = lazy.pending[name]
+                        result[name] = raw if copy_raw is None else copy_raw(raw)
+                    continue
+
+                result[name] = write(value)
+            return result
+
+        # Register the writer before compiling the fields to support recursive messages.
+        writers.register(descriptor, write_message)
+        fields.extend((field.name, field.private_name, writers.get(field.type))
+                      for field in descriptor.fields)
+        return write_message
+
+    # Readers.
+
+    def _compile_reader(self, descriptor, lazy=False):
+        type0 = descriptor.type
         Type = pdef.types.Type
 
-        if type0 == Type.DATETIME:
-            if not isinstance(obj, datetime):
-                raise ValueError('Not a datetime object %r' % datetime)
-            return obj.strftime(SIMPLE_ISO_8601_PATTERN)
+        if type0 in Type.PRIMITIVE_TYPES:
+            return descriptor.pyclass
+
+        elif type0 == Type.DATETIME:
+            return _read_datetime
 
         elif type0 == Type.ENUM:
-            return obj.lower()
+            return descriptor.find_value
 
-        elif type0 == Type.LIST:
-            elemd = descriptor.element
-            return [write(elem, elemd) for elem in obj]
+        readers = self._lazy_readers if lazy else self._readers
+        if type0 == Type.LIST:
+            return self._list_reader(descriptor, list, readers)
 
         elif type0 == Type.SET:
-            elemd = descriptor.element
-            return [write(elem, elemd) for elem in obj]
+            return self._list_reader(descriptor, set, readers)
 
         elif type0 == Type.MAP:
-            keyd = descriptor.key
-            valued = descriptor.value
-            return {write_key(k, keyd): write(v, valued) for k, v in obj.items() if k is not None}
+            return self._map_reader(descriptor, readers)
 
         elif type0 == Type.MESSAGE:
-            return self._message_to_dict(obj)
+            if lazy:
+                return self._lazy_message_reader(descriptor)
+            return self._message_reader(descriptor)
 
         elif type0 == Type.VOID:
+            return _none
+
+        raise ValueError('Unsupported type %s' % descriptor)
+
+    def _list_reader(self, descriptor, collection, readers):
+        read = readers.get(descriptor.element)
+
+        def read_list(data):
+            return collection([None if elem is None else read(elem) for elem in data])
+        return read_list
+
+    def _map_reader(self, descriptor, readers):
+        read_key = readers.get(descriptor.key)
+        read = readers.get(descriptor.value)
+
+        def read_map(data):
+            return {read_key(k): None if v is None else read(v) for k, v in data.items()}
+        return read_map
+
+    def _message_reader(self, descriptor):
+        owner = weakref.proxy(self)
+        fields = []
+
+        discriminator = descriptor.discriminator
+        discriminator_name = discriminator.name if discriminator else None
+
+        def read_message(data):
+            if discriminator_name is not None:
+                # Parse a discriminator value and find a subtype descriptor.
+                serialized = data.get(discriminator_name)
+                parsed = owner.read(serialized, discriminator.type)
+                subtype = descriptor.find_subtype(parsed)
+                if subtype is not descriptor:
+                    return owner.read(data, subtype)
+
+            message = descriptor.pyclass()
+            for name, private_name, read in fields:
+                serialized = data.get(name)
+                if serialized is None:
+                    continue
+
+                setattr(message, private_name, read(serialized))
+            return message
+
+        # Register the reader before compiling the fields to support recursive messages.
+        self._readers.register(descriptor, read_message)
+        fields.extend((field.name, field.private_name, self._readers.get(field.type))
+                      for field in descriptor.fields)
+        return read_message
+
+    def _lazy_message_reader(self, descriptor):
+        owner_ref = weakref.ref(self)
+        readers = self._lazy_readers
+        fields = {}
+
+        discriminator = descriptor.discriminator
+        discriminator_name = discriminator.name if discriminator else None
+
+        def read_message(data):
+            owner = owner_ref()
+            if discriminator_name is not None:
+                # The discriminator is always decoded to find a subtype.
+                serialized = data.get(discriminator_name)
+                parsed = owner.read(serialized, discriminator.type)
+                subtype = descriptor.find_subtype(parsed)
+                if subtype is not descriptor:
+                    return owner.read(data, subtype, lazy=True)
+
+            message = descriptor.pyclass()
+            pending = {}
+            for name in fields:
+                serialized = data.get(name)
+                if serialized is not None:
+                    pending[name] = serialized
+
+            if pending:
+                message._pdef_lazy = _LazyFields(pending, fields, owner)
+            return message
+
+        # Register the reader before compiling the fields to support recursive messages.
+        readers.register(descriptor, read_message)
+        fields.update((field.name, (field.private_name, readers.get(field.type)))
+                      for field in descriptor.fields if not field.is_discriminator)
+        return read_message
+
+
+class _LazyFields(object):
+    '''LazyFields holds not yet decoded JSON values of message fields.
+
+    It is stored in a message _pdef_lazy attribute, fields decode their values on the first
+    access and cache them in the message. The attribute is deleted (or set to None in slotted
+    messages) when all fields are decoded.
+    Use decode_all before accessing the message private attributes directly.
+
+    The owner format is kept alive until the fields are decoded, because compiled readers
+    reference it weakly.
+    '''
+    __slots__ = ('pending', 'fields', 'owner')
+
+    def __init__(self, pending, fields, owner=None):
+        self.pending = pending
+        self.fields = fields
+        self.owner = owner
+
+    def has(self, name):
+        return name in self.pending
+
+    def decode(self, message, name):
+        '''Decode a field value, set it in a message and return it, or return None.'''
+        serialized = self.pending.get(name)
+        if serialized is None:
             return None
 
-        raise ValueError('Unsupported type ' + descriptor)
+        # Keep the pending value until it is decoded, so a failed read can be retried.
+        private_name, read = self.fields[name]
+        value = read(serialized)
+        setattr(message, private_name, value)
+        self.pending.pop(name, None)
+
+        if not self.pending:
+            self._detach(message)
+        return value
+
+    def decode_all(self, message):
+        '''Decode all pending fields in a message.'''
+        for name in list(self.pending):
+            self.decode(message, name)
+
+    def discard(self, message, name):
+        '''Drop a pending field value.'''
+        if self.pending.pop(name, None) is not None and not self.pending:
+            self._detach(message)
+
+    def _detach(self, message):
+        if message._pdef_slots:
+            message._pdef_lazy = None
+        else:
+            # Concurrent decoders may detach the fields twice.
+            message.__dict__.pop('_pdef_lazy', None)
+
+
+class _JsonStreamEncoder(object):
+    '''JsonStreamEncoder incrementally encodes Pdef objects into JSON text chunks.
+
+    It walks values using compiled per-descriptor encoders and never builds
+    a JSON-compatible object tree, so memory does not depend on a collection size.
+    The output is the same as json.dumps of a written object, except that message keys
+    are always in the field order, Python 2 dicts are not ordered.
+    '''
+
+    def __init__(self, indent=None, compact=False):
+        self._json_indent = indent
+        if indent is not None and not isinstance(indent, _string_types):
+            indent = ' ' * indent
+
+        self.indent = indent
+        self.compact = compact and indent is None
+        self.item_separator = ', ' if indent is None and not self.compact else ','
+        self.key_separator = ':' if self.compact else ': '
+        self._encoders = _CodecCache(self._compile)
+
+    def iterencode(self, obj, descriptor):
+        '''Yield JSON text chunks of an object.'''
+        if obj is None:
+            yield 'null'
+            return
+
+        is_scalar, encode = self._encoders.get(descriptor)
+        if is_scalar:
+            yield encode(obj)
+            return
+
+        for chunk in encode(obj, 0):
+            yield chunk
 
-    def _write_key(self, key, keyd):
-        if key is None:
-            raise ValueError('None dict key')
+    def _delimiters(self, start, end, level):
+        '''Return (first, separator, last) strings for a collection at a nesting level.'''
+        indent = self.indent
+        if indent is None:
+            return start, self.item_separator, end
 
-        type0 = keyd.type
+        newline = '\n' + indent * (level + 1)
+        return start + newline, self.item_separator + newline, '\n' + indent * level + end
+
+    def _compile(self, descriptor):
+        '''Return a tuple (is_scalar, encode), where encode is encode(obj) for scalars
+        and a generator encode(obj, level) for collections and messages.'''
+        type0 = descriptor.type
         Type = pdef.types.Type
 
         if type0 == Type.BOOL:
-            return 'true' if key else 'false'
+            return True, _encode_bool
+
+        elif type0 in (Type.INT16, Type.INT32, Type.INT64):
+            pyclass = descriptor.pyclass
+            return True, lambda value: _encode_int(pyclass(value))
 
-        elif type0 in Type.PRIMITIVE_TYPES:
-            return str(key)
+        elif type0 in (Type.FLOAT, Type.DOUBLE):
+            return True, lambda value: _encode_float(float(value))
+
+        elif type0 == Type.STRING:
+            pyclass = descriptor.pyclass
+            return True, lambda value: _encode_string(pyclass(value))
 
         elif type0 == Type.DATETIME:
-            return key.strftime(SIMPLE_ISO_8601_PATTERN)
+            return True, lambda value: '"' + _write_datetime(value) + '"'
 
-        raise ValueError('Unsupported key type ' + keyd)
+        elif type0 == Type.ENUM:
+            return True, lambda value: '"' + value.lower() + '"'
 
-    def _message_to_dict(self, message):
-        if message is None:
-            return None
+        elif type0 in (Type.LIST, Type.SET):
+            return False, self._list_encoder(descriptor)
+
+        elif type0 == Type.MAP:
+            return False, self._map_encoder(descriptor)
+
+        elif type0 == Type.MESSAGE:
+            return False, self._message_encoder(descriptor)
+
+        elif type0 == Type.VOID:
+            return True, lambda value: 'null'
+
+        raise ValueError('Unsupported type %s' % descriptor)
+
+    def _list_encoder(self, descriptor):
+        owner = weakref.proxy(self)
+        is_scalar, encode = self._encoders.get(descriptor.element)
+
+        def encode_list(obj, level):
+            if not obj:
+                yield '[]'
+                return
+
+            first, separator, last = owner._delimiters('[', ']', level)
+            prefix = first
+            for elem in obj:
+                if elem is None:
+                    yield prefix + 'null'
+                elif is_scalar:
+                    yield prefix + encode(elem)
+                else:
+                    yield prefix
+                    for chunk in encode(elem, level + 1):
+                        yield chunk
+
+                prefix = separator
+            yield last
+        return encode_list
+
+    def _map_encoder(self, descriptor):
+        owner = weakref.proxy(self)
+        key_separator = self.key_separator
+        write_key = _key_writer(descriptor.key)
+        is_scalar, encode = self._encoders.get(descriptor.value)
+
+        def encode_map(obj, level):
+            if not obj:
+                yield '{}'
+                return
+
+            first, separator, last = owner._delimiters('{', '}', level)
+            prefix = first
+            for key, value in obj.items():
+                if key is None:
+                    continue
+
+                key = prefix + _encode_string(write_key(key)) + key_separator
+                if value is None:
+                    yield key + 'null'
+                elif is_scalar:
+                    yield key + encode(value)
+                else:
+                    yield key
+                    for chunk in encode(value, level + 1):
+                        yield chunk
+
+                prefix = separator
+
+            yield '{}' if prefix is first else last
+        return encode_map
+
+    def _message_encoder(self, descriptor):
+        owner = weakref.proxy(self)
+        encoders = self._encoders
+        fields = []
+
+        def encode_message(message, level):
+            if message.descriptor is not descriptor:
+                # Support polymorphic messages.
+                _, encode_subtype = owner._encoders.get(message.descriptor)
+                for chunk in encode_subtype(message, level):
+                    yield chunk
+                return
+
+            first, separator, last = owner._delimiters('{', '}', level)
+            prefix = first
+            buf = []
+            lazy = getattr(message, '_pdef_lazy', None)
+            for name, key, private_name, is_scalar, encode in fields:
+                value = getattr(message, private_name)
+                if value is None:
+                    if lazy is not None and lazy.has(name):
+                        # Write back a not decoded JSON value.
+                        buf.append(prefix)
+                        buf.append(key)
+                        buf.append(owner._encode_raw(lazy.pending[name], level + 1))
+                        prefix = separator
+                    continue
+
+                buf.append(prefix)
+                buf.append(key)
+                prefix = separator
+
+                if is_scalar:
+                    buf.append(encode(value))
+                    continue
+
+                # Flush the scalar fields and encode a collection or a message incrementally.
+                yield ''.join(buf)
+                buf = []
+                for chunk in encode(value, level + 1):
+                    yield chunk
+
+            if prefix is first:
+                yield '{}'
+            else:
+                buf.append(last)
+                yield ''.join(buf)
+
+        # Register the encoder before compiling the fields to support recursive messages.
+        encoders.register(descriptor, (False, encode_message))
+        for field in descriptor.fields:
+            key = _encode_string(field.name) + self.key_separator
+            is_scalar, encode = encoders.get(field.type)
+            fields.append((field.name, key, field.private_name, is_scalar, encode))
+
+        return encode_message
+
+    def _encode_raw(self, data, level):
+        '''Encode a JSON-compatible object at a nesting level.'''
+        indent = self.indent
+        if self.compact:
+            return _compact_encoder.encode(data)
+        if indent is None:
+            return _json.dumps(data, ensure_ascii=False)
+
+        # JSON strings cannot contain newlines, so nested lines can be simply indented.
+        s = _json.dumps(data, ensure_ascii=False, indent=self._json_indent, separators=(',', ': '))
+        return s.replace('\n', '\n' + indent * level)
+
+
+class _JsonArrayReader(object):
+    '''JsonArrayReader incrementally tokenizes a top-level JSON array from a file-like object
+    and yields its decoded elements.
+
+    The stream is read in chunks, only the current element is kept in memory.
+    Binary streams are decoded as UTF-8.
+    '''
+
+    def __init__(self, fp, buffer_size=STREAM_BUFFER_SIZE):
+        self.fp = fp
+        self.buffer_size = buffer_size
+
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._text_decoder = None
 
-        result = {}
-        to_object = self.write
-        descriptor = message.descriptor  # Support polymorphic messages.
+    def __iter__(self):
+        c = self._skip_whitespace()
+        if c != '[':
+            if self._decode() is None:
+                # A null array.
+                return
+            raise ValueError('Not a JSON array')
 
-        # field_tuples and private names are a performance optimization.
-        # It's about 30% faster.
-        for name, private_name, type0 in descriptor.field_tuples:
-            value = getattr(message, private_name)
-            if value is None:
+        self._pos += 1
+        if self._skip_whitespace() == ']':
+            return
+
+        while True:
+            yield self._decode()
+
+            c = self._skip_whitespace()
+            self._pos += 1
+            if c == ',':
+                self._skip_whitespace()
+            elif c == ']':
+                return
+            else:
+                raise ValueError('Expected "," or "]", got %r' % c)
+
+    def _read(self, size):
+        '''Read a chunk and append it to the unconsumed data, return False on EOF.'''
+        chunk = self.fp.read(size)
+        if not chunk:
+            self._eof = True
+            if self._text_decoder:
+                self._buf += self._text_decoder.decode(b'', True)
+            return False
+
+        if isinstance(chunk, bytes):
+            if self._text_decoder is None:
+                self._text_decoder = codecs.getincrementaldecoder(UTF8)()
+            chunk = self._text_decoder.decode(chunk)
+
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        '''Skip whitespace and return the next character or an empty string on EOF.'''
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+
+            if not self._read(self.buffer_size):
+                return ''
+
+    def _decode(self):
+        '''Decode the next JSON value, read more data if it is incomplete.'''
+        while True:
+            buf = self._buf
+            try:
+                value, end = _decoder.raw_decode(buf, self._pos)
+            except ValueError as e:
+                if self._eof or not _is_incomplete(e, len(buf)):
+                    raise
+
+                # Grow the reads geometrically for large values.
+                self._read(max(self.buffer_size, len(buf) - self._pos))
                 continue
 
-            result[name] = to_object(value, type0)
-        return result
+            if end == len(buf) and not self._eof:
+                # A number may continue in the next chunk.
+                if self._read(self.buffer_size):
+                    continue
 
-    def read(self, data, descriptor):
-        '''Read a pdef object from a native python type.'''
-        if data is None:
+            self._pos = end
+            return value
+
+
+def _is_incomplete(error, size):
+    '''Return whether a JSON decode error is caused by the end of a buffer of a given size.
+
+    Truncated values fail at the end of the buffer, or near it in literals and
+    escape sequences, and unterminated strings fail at their start.
+    Errors without a position (Python 2) are always considered incomplete,
+    so more data is read until the end of the stream.
+    '''
+    pos = getattr(error, 'pos', None)
+    if pos is None:
+        return True
+
+    msg = getattr(error, 'msg', '')
+    return pos >= size - _INCOMPLETE_TAIL_SIZE or msg.startswith('Unterminated string')
+
+
+class BinaryFormat(object):
+    '''BinaryFormat parses/serializes Pdef types from/to a compact binary format.
+
+    Integers, bools, enums and datetimes are varints (signed integers are zigzag-encoded),
+    floats and doubles are little-endian fixed-size values, strings, collections and nested
+    messages are length-prefixed. Message fields are written as varint tags
+    (field_number << 3 | wire_type), field numbers are 1-based positions in
+    MessageDescriptor.fields, and unknown fields are skipped on reading. The discriminator
+    of a polymorphic message is written first, so a subtype is known before its fields.
+
+    A top-level collection or message is written without a length prefix.
+    None is written as None, and None is read as None.
+    '''
+
+    def __init__(self):
+        self._codecs = _CodecCache(self._compile)
+
+    def read(self, s, descriptor):
+        '''Read a pdef object from bytes.'''
+        if s is None:
             return None
 
+        buf = _as_buffer(s)
+        _, _, read_payload = self._codecs.get(descriptor)
+        try:
+            value, _ = read_payload(buf, 0, len(buf))
+        except (IndexError, struct.error):
+            raise ValueError('Malformed binary data')
+        return value
+
+    def read_stream(self, fp, descriptor):
+        '''Read a pdef object from a binary file-like object.'''
+        return self.read(fp.read(), descriptor)
+
+    def write(self, obj, descriptor):
+        '''Write a pdef object to bytes.'''
+        if obj is None:
+            return None
+
+        out = bytearray()
+        _, write_payload, _ = self._codecs.get(descriptor)
+        write_payload(obj, out)
+        return bytes(out)
+
+    def write_to_stream(self, obj, descriptor, fp):
+        '''Write a pdef object to a binary file-like object.'''
+        data = self.write(obj, descriptor)
+        if data is not None:
+            fp.write(data)
+
+    def _compile(self, descriptor):
+        '''Return a tuple (wire_type, write_payload(obj, out), read_payload(buf, pos, end)).
+
+        The readers return tuples (value, pos). Length-delimited values are wrapped
+        by _value_writer/_value_reader when they are nested.
+        '''
         type0 = descriptor.type
         Type = pdef.types.Type
-        read = self.read
 
-        if type0 in Type.PRIMITIVE_TYPES:
-            return descriptor.pyclass(data)
+        if type0 == Type.BOOL:
+            return _WIRE_VARINT, _write_bool, _read_bool
+
+        elif type0 in (Type.INT16, Type.INT32, Type.INT64):
+            return _WIRE_VARINT, _write_zigzag, _read_zigzag
+
+        elif type0 == Type.FLOAT:
+            return _WIRE_FIXED32, _write_float, _read_float
+
+        elif type0 == Type.DOUBLE:
+            return _WIRE_FIXED64, _write_double, _read_double
+
+        elif type0 == Type.STRING:
+            return _WIRE_BYTES, _write_string, _read_string
 
         elif type0 == Type.DATETIME:
-            if isinstance(data, datetime):
-                return data
-            return datetime.strptime(data, SIMPLE_ISO_8601_PATTERN)
+            return _WIRE_VARINT, _write_binary_datetime, _read_binary_datetime
 
         elif type0 == Type.ENUM:
-            return descriptor.find_value(data)
+            return self._enum_codec(descriptor)
 
-        elif type0 == Type.LIST:
-            elemd = descriptor.element
-            return [read(elem, elemd) for elem in data]
-
-        elif type0 == Type.SET:
-            elemd = descriptor.element
-            return {read(elem, elemd) for elem in data}
+        elif type0 in (Type.LIST, Type.SET):
+            return self._list_codec(descriptor, list if type0 == Type.LIST else set)
 
         elif type0 == Type.MAP:
-            keyd = descriptor.key
-            valued = descriptor.value
-            return {read(k, keyd): read(v, valued) for k, v in data.items()}
+            return self._map_codec(descriptor)
 
         elif type0 == Type.MESSAGE:
-            return self._message_from_dict(data, descriptor)
+            return self._message_codec(descriptor)
 
         elif type0 == Type.VOID:
-            return None
+            return _WIRE_VARINT, _write_void, _read_void
 
-        raise ValueError('Unsupported type ' + descriptor)
+        raise ValueError('Unsupported type %s' % descriptor)
 
-    def _message_from_dict(self, dict0, descriptor):
-        '''Parse a message from a dictionary.'''
-        if dict0 is None:
-            return None
+    def _value_writer(self, descriptor):
+        '''Return a self-delimiting writer, it prefixes length-delimited payloads.'''
+        wire_type, write_payload, _ = self._codecs.get(descriptor)
+        if wire_type != _WIRE_BYTES or descriptor.type == pdef.types.Type.STRING:
+            return write_payload
 
-        from_object = self.read
+        def write_value(obj, out):
+            payload = bytearray()
+            write_payload(obj, payload)
+            _write_varint(len(payload), out)
+            out += payload
+        return write_value
 
-        if descriptor.is_polymorphic:
-            # Parse a discriminator value and find a subtype descriptor.
-            discriminator = descriptor.discriminator
-            serialized = dict0.get(discriminator.name)
-            parsed = from_object(serialized, discriminator.type)
-            descriptor = descriptor.find_subtype(parsed)
+    def _value_reader(self, descriptor):
+        '''Return a self-delimiting reader, it reads a length prefix of length-delimited payloads.'''
+        wire_type, _, read_payload = self._codecs.get(descriptor)
+        if wire_type != _WIRE_BYTES or descriptor.type == pdef.types.Type.STRING:
+            return read_payload
+
+        def read_value(buf, pos, end):
+            size, pos = _read_varint(buf, pos, end)
+            next_pos = pos + size
+            if next_pos > end:
+                raise ValueError('Malformed binary data, truncated value')
+
+            value, _ = read_payload(buf, pos, next_pos)
+            return value, next_pos
+        return read_value
+
+    def _enum_codec(self, descriptor):
+        values = descriptor.values
+        indexes = dict((value, index) for index, value in enumerate(values))
+
+        def write_enum(obj, out):
+            index = indexes.get(obj)
+            if index is None:
+                index = indexes.get(obj.upper())
+                if index is None:
+                    raise ValueError('Unknown enum value %r' % obj)
+            _write_varint(index, out)
+
+        def read_enum(buf, pos, end):
+            index, pos = _read_varint(buf, pos, end)
+            if index >= len(values):
+                raise ValueError('Malformed binary data, unknown enum index %s' % index)
+            return values[index], pos
+
+        return _WIRE_VARINT, write_enum, read_enum
+
+    def _list_codec(self, descriptor, collection):
+        write = self._value_writer(descriptor.element)
+        read = self._value_reader(descriptor.element)
+
+        def write_list(obj, out):
+            for elem in obj:
+                if elem is None:
+                    raise ValueError('Binary format does not support None elements')
+                write(elem, out)
+
+        def read_list(buf, pos, end):
+            result = []
+            append = result.append
+            while pos < end:
+                elem, pos = read(buf, pos, end)
+                append(elem)
+            return collection(result), pos
+
+        return _WIRE_BYTES, write_list, read_list
+
+    def _map_codec(self, descriptor):
+        write_key = self._value_writer(descriptor.key)
+        read_key = self._value_reader(descriptor.key)
+        write = self._value_writer(descriptor.value)
+        read = self._value_reader(descriptor.value)
+
+        def write_map(obj, out):
+            for key, value in obj.items():
+                if key is None:
+                    continue
+                if value is None:
+                    raise ValueError('Binary format does not support None map values')
+
+                write_key(key, out)
+                write(value, out)
+
+        def read_map(buf, pos, end):
+            result = {}
+            while pos < end:
+                key, pos = read_key(buf, pos, end)
+                value, pos = read(buf, pos, end)
+                result[key] = value
+            return result, pos
+
+        return _WIRE_BYTES, write_map, read_map
+
+    def _message_codec(self, descriptor):
+        codecs0 = weakref.proxy(self._codecs)
+        writers = []
+        readers = {}
+
+        discriminator_tag = None
+        read_discriminator = None
+
+        def write_message(message, out):
+            if message.descriptor is not descriptor:
+                # Support polymorphic messages.
+                _, write_subtype, _ = codecs0.get(message.descriptor)
+                return write_subtype(message, out)
+
+            lazy = getattr(message, '_pdef_lazy', None)
+            if lazy is not None:
+                lazy.decode_all(message)
+
+            for tag, private_name, write in writers:
+                value = getattr(message, private_name)
+                if value is None:
+                    continue
+
+                out += tag
+                write(value, out)
+
+        def read_message(buf, pos, end):
+            if discriminator_tag is not None and pos < end:
+                # Read the discriminator and find a subtype descriptor.
+                tag, next_pos = _read_varint(buf, pos, end)
+                if tag == discriminator_tag:
+                    value, _ = read_discriminator(buf, next_pos, end)
+                    subtype = descriptor.find_subtype(value)
+                    if subtype is not descriptor:
+                        _, _, read_subtype = codecs0.get(subtype)
+                        return read_subtype(buf, pos, end)
+
+            message = descriptor.pyclass()
+            while pos < end:
+                tag = buf[pos]
+                if tag < 0x80:
+                    pos += 1
+                else:
+                    tag, pos = _read_varint(buf, pos, end)
+
+                field = readers.get(tag)
+                if field is None:
+                    pos = _skip_binary_value(buf, pos, end, tag & 0x07)
+                    continue
+
+                private_name, read = field
+                value, pos = read(buf, pos, end)
+                setattr(message, private_name, value)
+            return message, pos
+
+        # Register the codec before compiling the fields to support recursive messages.
+        codecs0.register(descriptor, (_WIRE_BYTES, write_message, read_message))
+        for number, field in enumerate(descriptor.fields, 1):
+            wire_type, _, _ = codecs0.get(field.type)
+            tag = (number << 3) | wire_type
+
+            tag_bytes = bytearray()
+            _write_varint(tag, tag_bytes)
+            writer = (bytes(tag_bytes), field.private_name, self._value_writer(field.type))
+            if field.is_discriminator:
+                # Write the discriminator first.
+                writers.insert(0, writer)
+                discriminator_tag = tag
+                read_discriminator = self._value_reader(field.type)
+            else:
+                writers.append(writer)
+
+            readers[tag] = (field.private_name, self._value_reader(field.type))
+
+        return _WIRE_BYTES, write_message, read_message
+
+
+class _CodecCache(object):
+    '''Thread-safe cache of compiled codecs.
+
+    Codecs are stored in their descriptors in weak dictionaries keyed by caches, so they
+    live as long as both the descriptors and the cache. Compiled codecs must reference
+    their formats and caches only weakly, otherwise descriptors would keep them alive.
+
+    A codec is compiled on the first request for its descriptor. Codecs of nested
+    descriptors are published only when the outermost compilation completes, so other
+    threads never see a partially compiled recursive message codec.
+    '''
+
+    def __init__(self, compile0):
+        self._compile = compile0
+        self._pending = None
+        self._lock = threading.RLock()
+
+    def get(self, descriptor):
+        '''Return a compiled codec for a descriptor.'''
+        codecs = descriptor.__dict__.get('_pdef_codecs')
+        codec = codecs.get(self) if codecs else None
+        if codec is not None:
+            return codec
+
+        with self._lock:
+            codecs = descriptor.__dict__.get('_pdef_codecs')
+            codec = codecs.get(self) if codecs else None
+            if codec is not None:
+                return codec
+
+            outermost = self._pending is None
+            if outermost:
+                self._pending = {}
+
+            try:
+                codec = self._pending.get(descriptor)
+                if codec is None:
+                    codec = self._compile(descriptor)
+                    self._pending[descriptor] = codec
+
+                if outermost:
+                    for pending, pending_codec in self._pending.items():
+                        codecs = pending.__dict__.get('_pdef_codecs')
+                        if codecs is None:
+                            codecs = pending.__dict__.setdefault(
+                                '_pdef_codecs', weakref.WeakKeyDictionary())
+                        codecs[self] = pending_codec
+            finally:
+                if outermost:
+                    self._pending = None
+
+            return codec
+
+    def register(self, descriptor, codec):
+        '''Register an incomplete codec during compilation to support recursive types.'''
+        self._pending[descriptor] = codec
+
+
+def _none(value):
+    return None
+
+
+def _copy_json(data):
+    '''Return a deep copy of a JSON-compatible object.'''
+    if isinstance(data, dict):
+        return {k: _copy_json(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [_copy_json(v) for v in data]
+    return data
+
+
+def _key_writer(keyd):
+    '''Return a function which writes a map key as a string.'''
+    type0 = keyd.type
+    Type = pdef.types.Type
+
+    if type0 == Type.BOOL:
+        return _encode_bool
+
+    elif type0 in Type.PRIMITIVE_TYPES:
+        return str
+
+    elif type0 == Type.DATETIME:
+        return _write_datetime
+
+    raise ValueError('Unsupported key type %s' % keyd)
+
+
+def _write_datetime(obj):
+    '''Format a datetime as a "YYYY-MM-DDTHH:MM:SSZ" string in UTC.'''
+    if not isinstance(obj, datetime):
+        raise ValueError('Not a datetime object %r' % obj)
+
+    if obj.tzinfo is not None:
+        obj = _to_utc(obj)
+
+    return '%04d-%02d-%02dT%02d:%02d:%02dZ' % (
+        obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second)
+
+
+def _read_datetime(data):
+    if isinstance(data, datetime):
+        return data
+
+    dt = _datetime_cache.get(data)
+    if dt is None:
+        dt = _parse_datetime(data)
+        _datetime_cache.put(data, dt)
+    return dt
+
+
+def _parse_datetime(s):
+    '''Parse an ISO-8601 "YYYY-MM-DDTHH:MM:SS[.ffffff][Z|+HH:MM]" string into a naive UTC datetime.
+
+    This is a fixed-layout parser, it is much faster than datetime.strptime.
+    '''
+    try:
+        if s[4] != '-' or s[7] != '-' or s[10] not in 'Tt ' or s[13] != ':' or s[16] != ':':
+            raise ValueError
+
+        year, month, day = int(s[0:4]), int(s[5:7]), int(s[8:10])
+        hour, minute, second = int(s[11:13]), int(s[14:16]), int(s[17:19])
+
+        pos = 19
+        microsecond = 0
+        if s[pos:pos + 1] == '.':
+            start = pos = pos + 1
+            while s[pos:pos + 1].isdigit():
+                pos += 1
+
+            fraction = s[start:pos]
+            if not fraction:
+                raise ValueError
+            microsecond = int(fraction[:6].ljust(6, '0'))
+
+        offset = None
+        tz = s[pos:]
+        if tz in ('Z', 'z', ''):
+            pass
+        elif tz[0] in '+-' and len(tz) in (3, 5, 6):
+            minutes = int(tz[-2:]) if len(tz) > 3 else 0
+            if len(tz) == 6 and tz[3] != ':':
+                raise ValueError
+
+            offset = timedelta(hours=int(tz[1:3]), minutes=minutes)
+            if tz[0] == '-':
+                offset = -offset
+        else:
+            raise ValueError
+
+        dt = datetime(year, month, day, hour, minute, second, microsecond)
+    except (ValueError, IndexError, TypeError):
+        raise ValueError('Invalid ISO-8601 datetime %r' % s)
+
+    if offset:
+        dt -= offset
+    return dt
+
+
+def _to_utc(dt):
+    '''Convert an aware datetime into a naive UTC datetime.'''
+    offset = dt.utcoffset()
+    dt = dt.replace(tzinfo=None)
+    return dt - offset if offset else dt
+
+
+class _LruCache(object):
+    '''Small thread-safe LRU cache.'''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            items = self._items
+            items[key] = value
+            if len(items) > self.capacity:
+                items.popitem(last=False)
+
+
+def _write_enum(obj):
+    return obj.lower()
+
+
+def _encode_bool(value):
+    return 'true' if value else 'false'
+
+
+def _encode_int(value):
+    return '%d' % value
+
+
+def _encode_float(value):
+    if value != value:
+        return 'NaN'
+    elif value == _INFINITY:
+        return 'Infinity'
+    elif value == -_INFINITY:
+        return '-Infinity'
+    return repr(value)
+
+
+def _as_buffer(s):
+    '''Return an object which supports integer indexing and bytes slicing.'''
+    if isinstance(s, bytearray) or (not _PY2 and isinstance(s, bytes)):
+        return s
+    return bytearray(s)
+
+
+def _write_varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buf, pos, end):
+    if pos < end:
+        b = buf[pos]
+        if b < 0x80:
+            # A fast path for small values.
+            return b, pos + 1
+
+    result = 0
+    shift = 0
+    while True:
+        if pos >= end:
+            raise ValueError('Malformed binary data, truncated varint')
+
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_zigzag(value, out):
+    value = int(value)
+    _write_varint(value << 1 if value >= 0 else ((-value) << 1) - 1, out)
+
+
+def _read_zigzag(buf, pos, end):
+    value, pos = _read_varint(buf, pos, end)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def _write_bool(value, out):
+    out.append(1 if value else 0)
+
+
+def _read_bool(buf, pos, end):
+    value, pos = _read_varint(buf, pos, end)
+    return bool(value), pos
+
+
+def _write_float(value, out):
+    out += _FLOAT.pack(value)
+
+
+def _read_float(buf, pos, end):
+    if pos + 4 > end:
+        raise ValueError('Malformed binary data, truncated float')
+    return _FLOAT.unpack_from(buf, pos)[0], pos + 4
+
+
+def _write_double(value, out):
+    out += _DOUBLE.pack(value)
+
+
+def _read_double(buf, pos, end):
+    if pos + 8 > end:
+        raise ValueError('Malformed binary data, truncated double')
+    return _DOUBLE.unpack_from(buf, pos)[0], pos + 8
+
+
+def _write_string(value, out):
+    data = value.encode(UTF8)
+    _write_varint(len(data), out)
+    out += data
+
+
+def _read_string(buf, pos, end):
+    size, pos = _read_varint(buf, pos, end)
+    next_pos = pos + size
+    if next_pos > end:
+        raise ValueError('Malformed binary data, truncated string')
+    return buf[pos:next_pos].decode(UTF8), next_pos
+
+
+def _write_binary_datetime(value, out):
+    '''Write a datetime as zigzag-encoded microseconds since the epoch in UTC.'''
+    if not isinstance(value, datetime):
+        raise ValueError('Not a datetime object %r' % value)
+
+    if value.tzinfo is not None:
+        value = _to_utc(value)
+
+    delta = value - _EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    _write_zigzag(micros, out)
+
+
+def _read_binary_datetime(buf, pos, end):
+    micros, pos = _read_zigzag(buf, pos, end)
+    return _EPOCH + timedelta(microseconds=micros), pos
+
+
+def _write_void(value, out):
+    pass
+
+
+def _read_void(buf, pos, end):
+    return None, pos
+
+
+def _skip_binary_value(buf, pos, end, wire_type):
+    '''Skip an unknown field value and return the next position.'''
+    if wire_type == _WIRE_VARINT:
+        _, pos = _read_varint(buf, pos, end)
+        return pos
+    elif wire_type == _WIRE_FIXED64:
+        pos += 8
+    elif wire_type == _WIRE_BYTES:
+        size, pos = _read_varint(buf, pos, end)
+        pos += size
+    elif wire_type == _WIRE_FIXED32:
+        pos += 4
+    else:
+        raise ValueError('Malformed binary data, unknown wire type %s' % wire_type)
+
+    if pos > end:
+        raise ValueError('Malformed binary data, truncated field')
+    return pos
 
-        message = descriptor.pyclass()
-        for field in descriptor.fields:
-            serialized = dict0.get(field.name)
-            if serialized is None:
-                continue
 
-            parsed = from_object(serialized, field.type)
-            setattr(message, field.name, parsed)
+_INFINITY = float('inf')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = _json.JSONDecoder()
+_INCOMPLETE_TAIL_SIZE = 12  # A surrogate pair escape, the longest truncated token.
+_encode_string = _json.encoder.encode_basestring
+_compact_encoder = _json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
 
-        return message
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_BYTES = 2
+_WIRE_FIXED32 = 5
+_FLOAT = struct.Struct('<f')
+_DOUBLE = struct.Struct('<d')
+_EPOCH = datetime(1970, 1, 1)
+_datetime_cache = _LruCache(DATETIME_CACHE_SIZE)
 
 
 jsonformat = JsonFormat()
+binaryformat = BinaryFormat()
@@ -1,9 +1,7 @@
 # encoding: utf-8
-import copy
-from collections import deque
 
 
-def proxy(interface, invocation_handler):
+def proxy(interface, invocation_handler, copy_args=True):
     '''Create a interface proxy.
 
     The proxy captures method calls into chained invocations, and passes them
@@ -11,9 +9,11 @@ def proxy(interface, invocation_handler):
 
     @param interface:               Interface with a class descriptor field.
     @param invocation_handler:      callable(Invocation): InvocationResult.
+    @param copy_args:               When False, collection and message arguments are not copied,
+                                    the caller must not mutate them while they are in use.
     '''
     descriptor = interface.descriptor
-    return InvocationProxy(descriptor, invocation_handler)
+    return InvocationProxy(descriptor, invocation_handler, copy_args=copy_args)
 
 
 class Invocation(object):
@@ -22,33 +22,39 @@ class Invocation(object):
     def root(cls, method, *args, **kwargs):
         return Invocation(method, args=args, kwargs=kwargs)
 
-    def __init__(self, method, args=None, kwargs=None, parent=None):
+    @classmethod
+    def trusted(cls, method, kwargs, parent=None):
+        '''Create an invocation from complete kwargs without checking and copying them.
+
+        The kwargs must contain all method args, the invocation takes their ownership.
+        It is used for freshly parsed arguments, i.e. in RpcProtocol.
+        '''
+        invocation = cls.__new__(cls)
+        invocation.method = method
+        invocation.parent = parent
+        invocation.kwargs = kwargs
+        return invocation
+
+    def __init__(self, method, args=None, kwargs=None, parent=None, copy_args=True):
         '''Create an invocation.
 
         @param method: a method descriptor.
         @param parent: a parent invocation, nullable.
+        @param copy_args: whether to make defensive copies of collection and message args.
         '''
         self.method = method
         self.parent = parent
 
         self.kwargs = self._build_kwargs(method, args, kwargs) if method else {}
-        self.kwargs = copy.deepcopy(self.kwargs)    # Make defensive copies.
+        if method and copy_args:
+            self._copy_kwargs(method, self.kwargs)  # Make defensive copies.
 
     def __repr__(self):
         return '<Invocation %r args=%r>' % (self.method.name, self.kwargs)
 
     @property
     def kwargs_with_default_primitives(self):
-        result = {}
-        kwargs = self.kwargs
-
-        for argd in self.method.args:
-            arg = kwargs.get(argd.name)
-            if arg is None and argd.type.is_primitive:
-                arg = argd.type.default
-            result[argd.name] = arg
-
-        return result
+        return self.method.with_default_primitives(self.kwargs)
 
     def next(self, method, *args, **kwargs):
         '''Create a child invocation.'''
@@ -72,89 +78,75 @@ class Invocation(object):
 
         return obj
 
+    @staticmethod
+    def _copy_kwargs(method, kwargs):
+        '''Deep copy collection and message arguments in place.'''
+        for name, type0 in method.mutable_args:
+            value = kwargs.get(name)
+            if value is not None:
+                kwargs[name] = type0.deepcopy(value)
+
     @staticmethod
     def _build_kwargs(method, args=None, kwargs=None):
         '''Convert args and kwargs into a param dictionary, check their number and types.'''
-        def wrong_args():
-            return TypeError('Wrong method arguments, %s, got args=%s, kwargs=%s' %
-                             (method, args, kwargs))
-        params = {}
-        args = args if args else ()
-        kwargs = kwargs if kwargs else {}
-        method_args = deque(method.args)
-
-        # Check that the number of args and kwargs is less or equal to the method args number.
-        if len(method_args) < (len(args) + len(kwargs)):
-            raise wrong_args()
-
-        # Consume all positional arguments.
-        for value in args:
-            argd = method_args.popleft()
-            params[argd.name] = value
-
-        # Add keyword arguments using the remaining method args.
-        consumed_kwargs = {}
-        for argd in method_args:
-            if argd.name not in kwargs:
-                params[argd.name] = None
-                continue
-
-            value = kwargs.get(argd.name)
-            params[argd.name] = value
-            consumed_kwargs[argd.name] = value
-
-        # Check that all kwargs have been consumed.
-        if list(consumed_kwargs.keys()) != list(kwargs.keys()):
-            raise wrong_args()
-
-        return params
+        return method.bind(args, kwargs)
 
 
 class InvocationProxy(object):
     '''Reflective client proxy.'''
-    def __init__(self, descriptor, handler, invocation=None):
+    def __init__(self, descriptor, handler, invocation=None, copy_args=True):
         self._descriptor = descriptor
         self._handler = handler
         self._invocation = invocation
+        self._copy_args = copy_args
 
     def __repr__(self):
         return '<InvocationProxy %s>' % self._descriptor
 
     def __getattr__(self, name):
-        '''Return a proxy method.'''
+        '''Return a proxy method and cache it in the proxy.'''
         method = self._descriptor.find_method(name)
         if not method:
             raise AttributeError('Method not found %r' % name)
 
-        return _ProxyMethod(self._invocation, self._handler, method)
+        proxy_method = _ProxyMethod(self._invocation, self._handler, method, self._copy_args)
+        self.__dict__[name] = proxy_method  # Next lookups do not call __getattr__.
+        return proxy_method
 
 
 class _ProxyMethod(object):
-    def __init__(self, invocation, handler, method):
+    def __init__(self, invocation, handler, method, copy_args=True):
         self.invocation = invocation
         self.handler = handler
         self.method = method
+        self.copy_args = copy_args
+
+        self.is_terminal = method.is_terminal
+        self.default = method.result.default if method.result.is_primitive else None
+        self._child = None  # A cached proxy of a non-terminal method call without args.
 
     def __repr__(self):
         return '<ProxyMethod %r>' % self.method.name
 
     def __call__(self, *args, **kwargs):
-        method = self.method
-        if self.invocation:
-            invocation = self.invocation.next(method, *args, **kwargs)
-        else:
-            invocation = Invocation(method, args=args, kwargs=kwargs)
+        if not self.is_terminal and not args and not kwargs and self._child is not None:
+            return self._child
+
+        invocation = Invocation(self.method, args=args, kwargs=kwargs, parent=self.invocation,
+                                copy_args=self.copy_args)
 
-        if not method.is_terminal:
+        if not self.is_terminal:
             # This is a method, which returns an interface.
-            # Create a next invocation proxy.
-            return InvocationProxy(method.result, self.handler, invocation)
+            # Create a next invocation proxy, invocations are immutable,
+            # so a proxy without args can be reused.
+            child = InvocationProxy(self.method.result, self.handler, invocation, self.copy_args)
+            if not args and not kwargs:
+                self._child = child
+            return child
 
         # The method result is a value or void.
         result = self.handler(invocation)
         if result is not None:
             return result
 
-        if method.result.is_primitive:
-            return method.result.default
-        return None
+        return self.default
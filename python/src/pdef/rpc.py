@@ -1,9 +1,14 @@
 # encoding: utf-8
 from __future__ import absolute_import
+import json as _json
+import logging
+import threading
 import types
 import sys
+import weakref
 
 import requests
+import requests.adapters
 from pdefc.lang import TypeEnum
 
 import pdef
@@ -11,6 +16,13 @@ import pdef.descriptors
 from pdef.invoke import Invocation
 
 
+try:
+    # Python 2.7
+    _string_types = basestring
+except NameError:
+    # Python 3
+    _string_types = str
+
 try:
     # Python 2.7
     import httplib as http_codes
@@ -24,11 +36,33 @@ UTF8 = 'utf-8'
 APPLICATION_JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
 FORM_URLENCODED_MIME_TYPE = 'application/x-www-form-urlencoded'
 TEXT_PLAIN_CONTENT_TYPE = 'text/plain; charset=utf-8'
+JSON_MIME_TYPE = 'application/json'
+STREAM_THRESHOLD = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+_encode_json_string = _json.encoder.encode_basestring
+_TEXT_BOOLS = {'true': True, 'false': False}
 
 
-def rpc_client(interface, url, session=None):
+def rpc_client(interface, url, session=None, pool=None, timeout=None, prewarm=0):
     '''Create an RPC client.'''
-    return RpcClient(interface, url, session=session)
+    return RpcClient(interface, url, session=session, pool=pool, timeout=timeout,
+                     prewarm=prewarm)
+
+
+def http_pool(pool_connections=10, pool_maxsize=10, pool_block=False, timeout=None,
+              keep_alive=True, max_retries=0):
+    '''Create an HTTP connection pool which can be shared by RPC clients.'''
+    return HttpPool(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                    pool_block=pool_block, timeout=timeout, keep_alive=keep_alive,
+                    max_retries=max_retries)
+
+
+def async_rpc_client(interface, url, transport=None):
+    '''Create an asyncio RPC client, requires Python 3.5+, see pdef.aio.'''
+    from pdef.aio import AsyncRpcClient
+    return AsyncRpcClient(interface, url, transport=transport)
 
 
 def rpc_handler(interface, service):
@@ -36,9 +70,15 @@ def rpc_handler(interface, service):
     return RpcHandler(interface, service)
 
 
-def wsgi_app(handler):
-    '''Create a WSGI RPC server.'''
-    return WsgiRpcApp(handler)
+def asgi_app(handler, max_workers=10, indent=None):
+    '''Create an ASGI RPC server, requires Python 3.5+, see pdef.aio.'''
+    from pdef.aio import AsgiRpcApp
+    return AsgiRpcApp(handler, max_workers=max_workers, indent=indent)
+
+
+def wsgi_app(handler, indent=None):
+    '''Create a WSGI RPC server, it responds with compact JSON unless an indent is given.'''
+    return WsgiRpcApp(handler, indent=indent)
 
 
 class RpcException(Exception):
@@ -114,98 +154,303 @@ class RpcProtocol(object):
 
     def _to_json(self, kwarg, descriptor):
         '''Serialize a kwarg to json, strip quotes.'''
-        s = self.jsonformat.write(kwarg, descriptor)
-        return s.strip('"')
+        return self.get_text_codec(descriptor)[0](kwarg)
+
+    def get_text_codec(self, descriptor):
+        '''Return a tuple (encode, decode) of argument text functions for a type descriptor.
+
+        Strings are JSON-escaped without quotes, primitives, datetimes and enums are
+        formatted and parsed directly, messages and collections are JSON.
+        The codecs are compiled once and stored in the descriptor, keyed weakly
+        by the json format, so they do not keep the format alive.
+        '''
+        codecs = descriptor.__dict__.get('_pdef_text_codecs')
+        if codecs is None:
+            codecs = descriptor.__dict__.setdefault('_pdef_text_codecs',
+                                                    weakref.WeakKeyDictionary())
+
+        codec = codecs.get(self.jsonformat)
+        if codec is None:
+            codec = codecs.setdefault(self.jsonformat, self._compile_text_codec(descriptor))
+        return codec
+
+    def _compile_text_codec(self, descriptor):
+        type0 = descriptor.type
+        pyclass = descriptor.pyclass
+        jsonformat = weakref.proxy(self.jsonformat)
+
+        def read_json(s):
+            return jsonformat.read(s, descriptor)
+
+        def write_json(value):
+            return jsonformat.write(value, descriptor)
+
+        if type0 == TypeEnum.STRING:
+            return (lambda value: _encode_json_string(pyclass(value))[1:-1]), _decode_text_string
+
+        elif type0 == TypeEnum.BOOL:
+            def decode_bool(s):
+                value = _TEXT_BOOLS.get(s)
+                return read_json(s) if value is None else value
+
+            return (lambda value: 'true' if value else 'false'), decode_bool
+
+        elif type0 in (TypeEnum.INT16, TypeEnum.INT32, TypeEnum.INT64):
+            def decode_int(s):
+                try:
+                    return pyclass(int(s))
+                except ValueError:
+                    return read_json(s)
+
+            return (lambda value: str(pyclass(value))), decode_int
+
+        elif type0 in (TypeEnum.FLOAT, TypeEnum.DOUBLE):
+            def encode_float(value):
+                value = float(value)
+                if value - value != 0:
+                    # NaN and infinities.
+                    return write_json(value)
+                return repr(value)
 
-    def get_invocation(self, request, interface_descriptor):
-        '''Parse an invocation from an rpc request using an interface descriptor.'''
+            def decode_float(s):
+                try:
+                    return float(s)
+                except ValueError:
+                    return read_json(s)
+
+            return encode_float, decode_float
+
+        elif type0 in (TypeEnum.DATETIME, TypeEnum.ENUM):
+            return (lambda value: jsonformat.write_object(value, descriptor)), \
+                (lambda s: jsonformat.read_object(_unquote(s), descriptor))
+
+        return write_json, read_json
+
+    def get_routes(self, interface_descriptor):
+        '''Compile an interface descriptor into a routing table.
+
+        A routing table is a dict of method names to RpcRoutes, routes of interface
+        methods reference the routing tables of their result interfaces. Compile it once
+        and pass it to get_invocation, i.e. RpcHandler keeps the routes of its interface.
+        '''
+        if not interface_descriptor:
+            raise ValueError('Interface descriptor required')
+
+        tables = {}
+        stack = [interface_descriptor]
+        while stack:
+            descriptor = stack.pop()
+            if descriptor in tables:
+                continue
+
+            table = tables[descriptor] = {}
+            for method in descriptor.methods:
+                args = tuple((arg.name, self.get_text_codec(arg.type)[1]) for arg in method.args)
+                table[method.name] = RpcRoute(method, args)
+                if method.is_interface:
+                    stack.append(method.result)
+
+        # Link the interface routes after all tables are created to support cycles.
+        for table in tables.values():
+            for route in table.values():
+                if route.is_interface:
+                    route.next = tables[route.method.result]
+
+        return tables[interface_descriptor]
+
+    def get_invocation(self, request, interface_descriptor, routes=None):
+        '''Parse an invocation from an rpc request using an interface descriptor.
+
+        @param routes: Precompiled routes of the interface descriptor, see get_routes.
+        '''
         if not request:
             raise ValueError('Request required')
         if not interface_descriptor:
             raise ValueError('Interface descriptor required')
+        if routes is None:
+            routes = self.get_routes(interface_descriptor)
 
         invocation = None
         parts = request.path.strip('/').split('/')
+        count = len(parts)
+        index = 0
 
-        while parts:
-            part = parts.pop(0)
-
+        while index < count:
             # Find a method by a name.
-            method = interface_descriptor.find_method(part)
-            if not method:
+            route = routes.get(parts[index])
+            index += 1
+            if route is None:
                 raise RpcException(http_codes.BAD_REQUEST, 'Method not found')
 
             # Check the required HTTP method.
-            if method.is_post and not request.is_post:
+            if route.is_post and not request.is_post:
                 raise RpcException(http_codes.METHOD_NOT_ALLOWED,
                                    'Method not allowed, POST required')
 
             # Parse keyword arguments.
-            kwargs = self._read_kwargs(method, parts, request.query, request.post)
+            if route.is_interface:
+                end = index + len(route.args)
+                if end > count:
+                    raise RpcException(http_codes.NOT_FOUND, 'Wrong number of method args: "%s"'
+                                                             % route.method.name)
+                kwargs = self._read_path_kwargs(route, parts, index)
+                index = end
+            else:
+                kwargs = self._read_kwargs(route, request.post if route.is_post else request.query)
 
             # Create a root invocation,
             # or a next invocation in a chain.
-            invocation = invocation.next(method, **kwargs) \
-                if invocation else Invocation(method, kwargs=kwargs)
+            # The kwargs are freshly parsed, so they are neither checked nor copied.
+            invocation = Invocation.trusted(route.method, kwargs, parent=invocation)
 
-            if method.is_terminal:
+            if not route.is_interface:
                 break
 
             # It's an interface method.
-            # Get the next interface descriptor and proceed parsing the parts.
-            interface_descriptor = method.result
+            # Get the next interface routes and proceed parsing the parts.
+            routes = route.next
 
-        if parts:
+        if index < count:
             # No more interface descriptors in a chain, but the parts are still present.
             raise RpcException(http_codes.BAD_REQUEST, 'Failed to parse an invocation chain')
 
         if not invocation:
             raise RpcException(http_codes.BAD_REQUEST, 'Methods required')
 
-        if not invocation.method.is_terminal:
+        if invocation.method.is_interface:
             raise RpcException(http_codes.BAD_REQUEST, 'The last method must be a terminal one. '
                                                        'It must return a data type or be void.')
 
         return invocation
 
-    def _read_kwargs(self, method, parts, query, post):
+    def _read_path_kwargs(self, route, parts, index):
         kwargs = {}
+        for name, decode in route.args:
+            kwargs[name] = decode(urldecode(parts[index]))
+            index += 1
+        return kwargs
 
-        for argd in method.args:
-            name = argd.name
-
-            if method.is_interface:
-                if not parts:
-                    raise RpcException(http_codes.NOT_FOUND, 'Wrong number of method args: "%s"'
-                                                             % method.name)
-                value = urldecode(parts.pop(0))
-            elif method.is_post:
-                value = post.get(name)
-            else:
-                value = query.get(name)
-
-            if value is None:
-                kwargs[name] = None
-            else:
-                kwargs[name] = self._from_json(value, argd.type)
-
+    def _read_kwargs(self, route, params):
+        kwargs = {}
+        for name, decode in route.args:
+            value = params.get(name)
+            kwargs[name] = None if value is None else decode(value)
         return kwargs
 
     def _from_json(self, s, descriptor):
         if s is None:
             return None
 
-        type0 = descriptor.type
-        if type0 in (TypeEnum.STRING, TypeEnum.DATETIME, TypeEnum.ENUM):
-            if not (s.startswith('"') and s.endswith('"')):
-                # Return the quotes to get a valid json string.
-                s = '"' + s + '"'
+        return self.get_text_codec(descriptor)[1](s)
+
+    # Batches.
+
+    def write_batch_request(self, invocations):
+        '''Serialize terminal invocations into a JSON batch request body.
+
+        A batch request is a POST to the root path with a JSON list of requests,
+        each of them is an object {"method", "path", "query", "post"}.
+        '''
+        items = []
+        for invocation in invocations:
+            request = self.get_request(invocation)
+            items.append({'method': request.method, 'path': request.path,
+                          'query': request.query, 'post': request.post})
+        return self.jsonformat.backend.dumps(items)
+
+    def read_batch_request(self, s):
+        '''Parse rpc requests from a JSON batch request body, raise ValueError when malformed.'''
+        items = self.jsonformat.backend.loads_bytes(s) if isinstance(s, bytes) \
+            else self.jsonformat.backend.loads(s)
+        if not isinstance(items, list):
+            raise ValueError('Batch request must be a list')
+
+        requests0 = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError('Batch request item must be an object')
+
+            method = item.get('method') or GET
+            path = item.get('path') or ''
+            query = item.get('query') or {}
+            post = item.get('post') or {}
+            if method not in (GET, POST) or not isinstance(path, _string_types) \
+                    or not _is_string_dict(query) or not _is_string_dict(post):
+                raise ValueError('Malformed batch request item')
+
+            requests0.append(RpcRequest(method, path=path, query=query, post=post))
+        return requests0
+
+    def write_batch_response(self, results, indent=None):
+        '''Serialize a list of tuples (status, rpc_result or error message) into UTF-8 JSON bytes.
+
+        Each item is an rpc result object with a status, or an object {"status", "message"}.
+        The JSON is compact when there is no indent.
+        '''
+        items = []
+        for status, result in results:
+            if isinstance(result, pdef.Message):
+                item = self.jsonformat.object_format.write(result, result.descriptor, copy=False)
+            else:
+                item = {'message': result}
+
+            item['status'] = status
+            items.append(item)
+
+        backend = self.jsonformat.backend
+        if indent is None:
+            return backend.dumps_compact_bytes(items)
+        return backend.dumps_bytes(items, indent=indent)
+
+    def read_batch_response(self, b, invocations, excd=None):
+        '''Parse a JSON batch response, return a list of rpc results or RpcExceptions.'''
+        items = self.jsonformat.backend.loads_bytes(b)
+        if not isinstance(items, list) or len(items) != len(invocations) \
+                or not all(isinstance(item, dict) for item in items):
+            raise RpcException(http_codes.INTERNAL_SERVER_ERROR, 'Malformed batch response')
+
+        results = []
+        for invocation, item in zip(invocations, items):
+            status = item.get('status')
+            if status not in (http_codes.OK, http_codes.UNPROCESSABLE_ENTITY):
+                results.append(RpcException(status, item.get('message')))
+                continue
+
+            result_class = rpc_result_class(invocation.method.result, excd)
+            result = self.jsonformat.read_object(item, result_class.descriptor)
+            if status == http_codes.UNPROCESSABLE_ENTITY and not result.has_error:
+                result = RpcException(status, 'Unsupported application exception')
+            results.append(result)
+        return results
+
+
+class RpcRoute(object):
+    '''Precompiled method route, see RpcProtocol.get_routes.'''
+    __slots__ = ('method', 'is_post', 'is_interface', 'args', 'next')
+
+    def __init__(self, method, args):
+        self.method = method
+        self.is_post = method.is_post
+        self.is_interface = method.is_interface
+        self.args = args  # (name, decode) tuples.
+        self.next = None  # Routes of the result interface.
 
-        return self.jsonformat.read(s, descriptor)
+    def __repr__(self):
+        return '<RpcRoute %r>' % self.method.name
 
 
 class RpcClient(object):
-    def __init__(self, interface, url, session=None, protocol=None):
+    '''HTTP RPC client based on requests.
+
+    @param session:     A requests session, the default is a session of the pool.
+    @param pool:        An HttpPool to share connections with other clients,
+                        the default is a new pool.
+    @param timeout:     Seconds or a tuple (connect, read), the default is the pool timeout.
+    @param prewarm:     Number of connections to open to the url host in advance.
+    '''
+
+    def __init__(self, interface, url, session=None, protocol=None, pool=None, timeout=None,
+                 prewarm=0):
         if not interface:
             raise ValueError('Interface required')
         if not url:
@@ -215,11 +460,26 @@ class RpcClient(object):
         self.interface_descriptor = interface.descriptor
 
         self.url = url
-        self.session = session or requests.session()
+        self.pool = pool if pool or session else HttpPool()
+        self.session = session or self.pool.session
         self.protocol = protocol or RpcProtocol()
 
-    def proxy(self):
-        return pdef.proxy(self.interface, self)
+        if timeout is None and self.pool:
+            timeout = self.pool.timeout
+        self.timeout = timeout
+
+        # Create the result classes in advance.
+        rpc_result_classes(self.interface_descriptor)
+
+        if prewarm:
+            if not self.pool:
+                raise ValueError('Pool required to prewarm connections')
+            self.pool.prewarm(url, prewarm)
+
+    def proxy(self, copy_args=True):
+        '''Create an interface proxy, arguments are serialized on calls, so they can be
+        passed without copying when they are not mutated by other threads.'''
+        return pdef.proxy(self.interface, self, copy_args=copy_args)
 
     def __call__(self, invocation):
         if not invocation:
@@ -234,6 +494,81 @@ class RpcClient(object):
         request = self._build_request(rpc_request)
         return self._send(request, resultd, excd)
 
+    def map(self, invocations, max_workers=None, executor=None):
+        '''Execute invocations concurrently and return a list of rpc results in their order.
+
+        Application exceptions are returned in the result errors and do not abort the batch.
+        Other exceptions are raised when all invocations complete. Python 2.7 requires
+        the futures package.
+
+        @param invocations: Terminal invocations, i.e. captured by
+                            pdef.proxy(interface, lambda invocation: invocation).
+        @param max_workers: Max concurrent invocations, the default is the pool max size.
+        @param executor:    A concurrent.futures executor, the default is a new thread pool.
+        '''
+        from concurrent.futures import ThreadPoolExecutor, wait
+
+        invocations = list(invocations)
+        if not invocations:
+            return []
+
+        if executor is None:
+            max_workers = max_workers or (self.pool.pool_maxsize if self.pool else 10)
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(invocations))) as executor:
+                return self.map(invocations, executor=executor)
+
+        futures = [executor.submit(self._invoke_result, inv) for inv in invocations]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def batch(self, invocations):
+        '''Execute invocations in one batch HTTP request and return a list of rpc results.
+
+        Application exceptions are returned in the result errors, the first other error
+        is raised.
+        '''
+        results = self._send_batch(list(invocations))
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def batching(self, window=0.002, max_batch_size=100):
+        '''Create an RpcBatcher which coalesces concurrent calls into batch requests.'''
+        return RpcBatcher(self, window=window, max_batch_size=max_batch_size)
+
+    def _send_batch(self, invocations):
+        '''Send a batch request, return a list of rpc results or RpcExceptions.'''
+        if not invocations:
+            return []
+
+        body = self.protocol.write_batch_request(invocations)
+        request = requests.Request(method=POST, url=self.url, data=body.encode(UTF8),
+                                   headers={'Content-Type': APPLICATION_JSON_CONTENT_TYPE})
+        response = self.session.send(request.prepare(), timeout=self.timeout)
+        if response.status_code != http_codes.OK:
+            return parse_error(response)
+
+        excd = self.interface_descriptor.exc
+        return self.protocol.read_batch_response(response.content, invocations, excd)
+
+    def _invoke_result(self, invocation):
+        '''Execute an invocation and return an rpc result with its data or application error.'''
+        resultd = invocation.method.result
+        excd = self.interface_descriptor.exc
+        result_class = rpc_result_class(resultd, excd)
+
+        try:
+            data = self(invocation)
+        except Exception as e:
+            if excd and isinstance(e, excd.pyclass):
+                return result_class(error=e)
+            raise
+
+        if data is None and resultd.is_primitive:
+            data = resultd.default
+        return result_class(data)
+
     def _build_request(self, rpc_request):
         url = self._build_url(rpc_request.path)
         return requests.Request(method=rpc_request.method,
@@ -247,38 +582,211 @@ class RpcClient(object):
     def _send(self, request, resultd, excd=None):
         session = self.session
         prepared = request.prepare()
-        response = session.send(prepared)
+        response = session.send(prepared, timeout=self.timeout)
         return self._parse_response(response, resultd, excd)
 
     def _parse_response(self, response, resultd, excd=None):
-        code = response.status_code
+        return parse_response(response, resultd, excd, jsonformat=self.protocol.jsonformat)
+
+    def _parse_error(self, response):
+        return parse_error(response)
 
-        if code not in (http_codes.OK, http_codes.UNPROCESSABLE_ENTITY):
-            # It's an HTTP error.
-            return self._parse_error(response)
 
-        # It's a successful rpc result.
-        text = response.text
+class RpcBatcher(object):
+    '''Invocation handler which coalesces calls from concurrent threads into batch requests.
 
-        # Create a generic rpc result class.
-        result_class = rpc_result_class(resultd, excd)
-        result = result_class.from_json(text)
+    The first call of a batch waits for the window or until the batch is full, sends
+    the batch and wakes up the other callers. A batch of one call is sent as a usual request.
 
-        if code == http_codes.OK:
-            return result.data
-        else:
-            exc = result.error or RpcException(code, 'Unsupported application exception')
-            raise exc
+    @param window:          Seconds to wait for more calls.
+    @param max_batch_size:  Max calls in one batch request.
+    '''
 
-    def _parse_error(self, response):
+    def __init__(self, client, window=0.002, max_batch_size=100):
+        if not client:
+            raise ValueError('Client required')
+        self.client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def proxy(self, copy_args=True):
+        return pdef.proxy(self.client.interface, self, copy_args=copy_args)
+
+    def __call__(self, invocation):
+        if not invocation:
+            raise ValueError('Invocation required')
+
+        call = _BatchCall(invocation)
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+
+            batch.calls.append(call)
+            if len(batch.calls) >= self.max_batch_size:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._send(batch.calls)
+
+        return call.get()
+
+    def _send(self, calls):
         try:
-            text = response.text
+            if len(calls) == 1:
+                call = calls[0]
+                try:
+                    call.done(self.client(call.invocation))
+                except Exception as e:
+                    call.fail(e)
+                return
+
+            results = self.client._send_batch([call.invocation for call in calls])
         except Exception as e:
-            text = 'Failed to get the response text, e=%s' % e
+            for call in calls:
+                call.fail(e)
+            return
+
+        for call, result in zip(calls, results):
+            if isinstance(result, Exception):
+                call.fail(result)
+            elif result.has_error:
+                call.fail(result.error)
+            else:
+                call.done(result.data)
+
+
+class _Batch(object):
+    def __init__(self):
+        self.calls = []
+        self.full = threading.Event()
+
+
+class _BatchCall(object):
+    def __init__(self, invocation):
+        self.invocation = invocation
+        self.result = None
+        self.exc = None
+        self._event = threading.Event()
+
+    def done(self, result):
+        self.result = result
+        self._event.set()
+
+    def fail(self, exc):
+        self.exc = exc
+        self._event.set()
+
+    def get(self):
+        self._event.wait()
+        if self.exc is not None:
+            raise self.exc
+        return self.result
+
+
+class HttpPool(object):
+    '''HTTP connection pool, a requests session with a pooled keep-alive adapter.
+
+    Pools are thread-safe, clients which share a pool reuse connections to the same hosts.
+
+    @param pool_connections:    Number of per-host pools to keep.
+    @param pool_maxsize:        Max connections to keep per host.
+    @param pool_block:          Whether to wait for a free connection when a host pool
+                                is exhausted instead of opening a temporary one.
+    @param timeout:             Seconds or a tuple (connect, read), the default is no timeout.
+    @param keep_alive:          Whether to keep connections alive.
+    @param max_retries:         Max retries of failed connections.
+    '''
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, timeout=None,
+                 keep_alive=True, max_retries=0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                     pool_maxsize=pool_maxsize,
+                                                     pool_block=pool_block,
+                                                     max_retries=max_retries)
+        self.session = requests.session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
 
-        # Limit the text to use in as an exception description.
-        text = text if len(text) < 255 else text[:255]
-        raise RpcException(response.status_code, text)
+    def __repr__(self):
+        return '<HttpPool maxsize=%s>' % self.pool_maxsize
+
+    def prewarm(self, url, connections=1):
+        '''Open connections to a url host and put them into the pool, return their number.
+
+        The number is limited by the pool max size. Prewarming is best-effort, it stops
+        on the first connection error, and it is a no-op when the installed urllib3
+        does not provide the connection pool methods it relies on.
+        '''
+        if not self.keep_alive or connections <= 0:
+            return 0
+
+        try:
+            pool = self._connection_pool(url)
+        except Exception:
+            return 0
+
+        get_conn = getattr(pool, '_get_conn', None)
+        put_conn = getattr(pool, '_put_conn', None)
+        if get_conn is None or put_conn is None:
+            return 0
+
+        timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+        conns = []
+        try:
+            for _ in range(min(connections, self.pool_maxsize)):
+                conn = get_conn()
+                conns.append(conn)
+                if not _is_connected(conn):
+                    if timeout is not None:
+                        conn.timeout = timeout
+                    conn.connect()
+        except Exception:
+            pass  # Stop on the first error, the host may be down.
+
+        # Return all taken connections, failed ones are reconnected on use.
+        count = sum(1 for conn in conns if _is_connected(conn))
+        for conn in conns:
+            put_conn(conn)
+        return count
+
+    def close(self):
+        '''Close all connections.'''
+        self.session.close()
+
+    def _connection_pool(self, url):
+        '''Return a urllib3 connection pool which the session uses for a url.'''
+        adapter = self.session.get_adapter(url)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            # Newer requests key https pools by their TLS settings.
+            request = requests.Request(GET, url).prepare()
+            return adapter.get_connection_with_tls_context(request, self.session.verify,
+                                                           cert=self.session.cert)
+        return adapter.get_connection(url)
+
+
+def _is_connected(conn):
+    '''Return whether a urllib3 connection has an open socket.'''
+    connected = getattr(conn, 'is_connected', None)
+    if connected is not None:
+        return connected
+    return getattr(conn, 'sock', None) is not None
 
 
 class RpcHandler(object):
@@ -291,46 +799,82 @@ class RpcHandler(object):
         self.interface_descriptor = interface.descriptor
         self.service = service
         self.protocol = protocol or RpcProtocol()
+        self.result_classes = rpc_result_classes(self.interface_descriptor)
+        self.routes = self.protocol.get_routes(self.interface_descriptor)
 
     def __call__(self, rpc_request):
         return self.handle(rpc_request)
 
     def handle(self, rpc_request):
         '''Handle an rpc request and return a tuple (is_successful, rpc_result).'''
-        if not rpc_request:
-            raise ValueError('Rpc request required')
-
-        invocation = self.protocol.get_invocation(rpc_request, self.interface_descriptor)
-
-        method = invocation.method
-        datad = method.result
-        excd = self.interface_descriptor.exc
-        result_class = rpc_result_class(datad, excd)
+        invocation = self.get_invocation(rpc_request)
 
         try:
             data = invocation.invoke(self.service)
-            return True, result_class(data)
+            return True, self.get_result(invocation, data)
         except Exception as e:
-            if excd and isinstance(e, excd.pyclass):
+            if self.is_application_exc(e):
                 # It's an expected application exception.
-                return False, result_class(data=None, error=e)
+                return False, self.get_result(invocation, error=e)
 
             # Not an application exception, reraise it.
             raise
 
+    def get_invocation(self, rpc_request):
+        '''Parse an invocation from an rpc request.'''
+        if not rpc_request:
+            raise ValueError('Rpc request required')
+
+        return self.protocol.get_invocation(rpc_request, self.interface_descriptor,
+                                            routes=self.routes)
+
+    def get_result(self, invocation, data=None, error=None):
+        '''Return an rpc result of an invocation.'''
+        method = invocation.method
+        result_class = self.result_classes.get(method) \
+            or rpc_result_class(method.result, self.interface_descriptor.exc)
+        return result_class(data=data, error=error)
+
+    def is_application_exc(self, e):
+        '''Return whether an exception is an instance of the interface exception.'''
+        excd = self.interface_descriptor.exc
+        return excd is not None and isinstance(e, excd.pyclass)
+
 
 class WsgiRpcApp(object):
-    '''WSGI RPC application.'''
+    '''WSGI RPC application.
+
+    It also handles batch requests, POSTs to the root path with a JSON list of requests,
+    see RpcProtocol.write_batch_request. Each of them is passed to the handler, the response
+    is a JSON list of per-request results and errors.
+
+    Collection results are encoded incrementally, when their JSON exceeds the stream
+    threshold, the app returns a generator of encoded chunks without a Content-Length,
+    so WSGI servers stream them.
+
+    @param max_batch_size:      Max requests in one batch.
+    @param indent:              JSON response indent, the default is compact JSON.
+    @param stream_threshold:    Min size of streamed collection results in bytes,
+                                None disables streaming.
+    '''
 
-    def __init__(self, handler):
+    def __init__(self, handler, protocol=None, max_batch_size=1000, indent=None,
+                 stream_threshold=STREAM_THRESHOLD):
         if not handler:
             raise ValueError('Handler required')
         self.handler = handler
+        self.protocol = protocol or RpcProtocol()
+        self.max_batch_size = max_batch_size
+        self.indent = indent
+        self.stream_threshold = stream_threshold
 
     def __call__(self, environ, start_response):
         return self.handle(environ, start_response)
 
     def handle(self, environ, start_response):
+        if self._is_batch(environ):
+            return self.handle_batch(environ, start_response)
+
         request = self._parse_request(environ)
         try:
             success, result = self.handler(request)
@@ -340,10 +884,70 @@ class WsgiRpcApp(object):
             return self._response(start_response, status, content)
 
         status_code = http_codes.OK if success else http_codes.UNPROCESSABLE_ENTITY
-        content = result.to_json(indent=True)
+        if self.stream_threshold is not None and success and _is_collection(result.data):
+            return self._stream_response(start_response, status_code, result)
+
+        content = self.protocol.jsonformat.write_bytes(result, result.descriptor,
+                                                       indent=self.indent, compact=True)
         return self._response(start_response, status_code, content,
                               content_type=APPLICATION_JSON_CONTENT_TYPE)
 
+    def _stream_response(self, start_response, status_code, result):
+        '''Encode a result incrementally, return a usual response when it is below
+        the stream threshold, or a generator of the buffered and the remaining chunks.'''
+        chunks = self.protocol.jsonformat.iter_bytes(result, result.descriptor,
+                                                     indent=self.indent, compact=True)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size > self.stream_threshold:
+                break
+        else:
+            return self._response(start_response, status_code, b''.join(head),
+                                  content_type=APPLICATION_JSON_CONTENT_TYPE)
+
+        reason = http_codes.responses.get(status_code)
+        start_response('%s %s' % (status_code, reason),
+                       [('Content-Type', APPLICATION_JSON_CONTENT_TYPE)])
+        return _iter_stream_body(head, chunks)
+
+    def handle_batch(self, environ, start_response):
+        try:
+            requests0 = self.protocol.read_batch_request(self._read_wsgi_body(environ))
+        except ValueError:
+            return self._response(start_response, http_codes.BAD_REQUEST,
+                                  'Malformed batch request')
+
+        if len(requests0) > self.max_batch_size:
+            return self._response(start_response, http_codes.REQUEST_ENTITY_TOO_LARGE,
+                                  'Too many requests in a batch, max %s' % self.max_batch_size)
+
+        results = [self._handle_batch_item(request) for request in requests0]
+        content = self.protocol.write_batch_response(results, indent=self.indent)
+        return self._response(start_response, http_codes.OK, content,
+                              content_type=APPLICATION_JSON_CONTENT_TYPE)
+
+    def _handle_batch_item(self, request):
+        '''Return a tuple (status, rpc_result or error message), never raise.'''
+        try:
+            success, result = self.handler(request)
+        except RpcException as e:
+            return e.status or http_codes.INTERNAL_SERVER_ERROR, \
+                e.message or 'Internal server error'
+        except Exception:
+            # Do not abort the other requests in the batch.
+            logger.exception('Failed to handle a batch request %s', request)
+            return http_codes.INTERNAL_SERVER_ERROR, 'Internal server error'
+
+        return (http_codes.OK if success else http_codes.UNPROCESSABLE_ENTITY), result
+
+    def _is_batch(self, env):
+        return env['REQUEST_METHOD'] == POST \
+            and env.get('CONTENT_TYPE', '').lower().startswith(JSON_MIME_TYPE) \
+            and not env.get('PATH_INFO', '').strip('/')
+
     def _parse_request(self, env):
         '''Create an http server request from a wsgi request.'''
         method = env['REQUEST_METHOD']
@@ -361,11 +965,10 @@ class WsgiRpcApp(object):
 
     def _read_wsgi_post(self, env):
         ctype = env.get('CONTENT_TYPE', '')
-        clength = self._read_wsgi_clength(env)
 
         body = None
-        if clength > 0 and ctype.lower().startswith(FORM_URLENCODED_MIME_TYPE):
-            body = env['wsgi.input'].read(clength)
+        if ctype.lower().startswith(FORM_URLENCODED_MIME_TYPE):
+            body = self._read_wsgi_body(env)
 
         if not body:
             return {}
@@ -375,6 +978,10 @@ class WsgiRpcApp(object):
 
         return self._parse_query(body)
 
+    def _read_wsgi_body(self, env):
+        clength = self._read_wsgi_clength(env)
+        return env['wsgi.input'].read(clength) if clength > 0 else b''
+
     def _read_wsgi_clength(self, env):
         clength = env.get('CONTENT_LENGTH') or 0
         try:
@@ -389,11 +996,13 @@ class WsgiRpcApp(object):
             result[key] = values[0] if values else ''
         return result
 
-    def _response(self, start_response, status_code, unicode_content, content_type=None):
+    def _response(self, start_response, status_code, content, content_type=None):
+        '''Start a response and return its body, the content is UTF-8 bytes or a string.'''
         reason = http_codes.responses.get(status_code)
         status = '%s %s' % (status_code, reason)
 
-        content = unicode_content.encode(UTF8)
+        if not isinstance(content, bytes):
+            content = content.encode(UTF8)
         content_type = content_type or TEXT_PLAIN_CONTENT_TYPE
         headers = [('Content-Type', content_type),
                    ('Content-Length', str(len(content)))]
@@ -402,9 +1011,118 @@ class WsgiRpcApp(object):
         return [content]
 
 
+def _is_collection(data):
+    return isinstance(data, (list, set, dict))
+
+
+def _iter_stream_body(head, chunks):
+    for chunk in head:
+        yield chunk
+    for chunk in chunks:
+        yield chunk
+
+
+def _unquote(s):
+    if len(s) > 1 and s[0] == '"' and s[-1] == '"':
+        return s[1:-1]
+    return s
+
+
+def _decode_text_string(s):
+    if len(s) > 1 and s[0] == '"' and s[-1] == '"':
+        # A quoted json string.
+        return _json.loads(s)
+
+    if '\\' not in s:
+        return s
+
+    # Return the quotes to get a valid json string.
+    return _json.loads('"' + s + '"')
+
+
+def _is_string_dict(d):
+    return isinstance(d, dict) and all(isinstance(v, _string_types) for v in d.values())
+
+
+def parse_response(response, resultd, excd=None, jsonformat=None):
+    '''Return a result data from an HTTP response or raise an exception.
+
+    The result is parsed directly from the UTF-8 content bytes, the text is used only
+    for error descriptions. This skips the charset detection and the decoded text copy.
+
+    @param response:    An object with status_code, content and text attributes,
+                        i.e. requests.Response.
+    @param jsonformat:  A JsonFormat to parse the result, the default is pdef.jsonformat.
+    '''
+    code = response.status_code
+
+    if code not in (http_codes.OK, http_codes.UNPROCESSABLE_ENTITY):
+        # It's an HTTP error.
+        return parse_error(response)
+
+    # It's a successful rpc result.
+    result_class = rpc_result_class(resultd, excd)
+    jsonformat = jsonformat or pdef.jsonformat
+    result = jsonformat.read_bytes(response.content, result_class.descriptor)
+
+    if code == http_codes.OK:
+        return result.data
+    else:
+        exc = result.error or RpcException(code, 'Unsupported application exception')
+        raise exc
+
+
+def parse_error(response):
+    '''Raise an RpcException from an HTTP error response.'''
+    try:
+        text = response.text
+    except Exception as e:
+        text = 'Failed to get the response text, e=%s' % e
+
+    # Limit the text to use in as an exception description.
+    text = text if len(text) < 255 else text[:255]
+    raise RpcException(response.status_code, text)
+
+
 def rpc_result_class(datad, excd=None):
-    '''Create a generic RpcResult class with a given data and exception descriptors.'''
+    '''Return a generic RpcResult class with a given data and exception descriptors.
+
+    The classes are created once and cached in the data descriptors, so they live
+    as long as the descriptors.
+    '''
+    classes = datad.__dict__.get('_rpc_result_classes')
+    if classes is None:
+        classes = datad.__dict__.setdefault('_rpc_result_classes', {})
+
+    result_class = classes.get(excd)
+    if result_class is None:
+        result_class = classes.setdefault(excd, _create_rpc_result_class(datad, excd))
+    return result_class
+
+
+def rpc_result_classes(interface_descriptor):
+    '''Return a dict of result classes of terminal methods in an interface and in interfaces
+    returned by its methods, all of them use the interface exception.'''
+    excd = interface_descriptor.exc
+    result = {}
+
+    stack = [interface_descriptor]
+    seen = set()
+    while stack:
+        descriptor = stack.pop()
+        if descriptor in seen:
+            continue
+        seen.add(descriptor)
+
+        for method in descriptor.methods:
+            if method.is_terminal:
+                result[method] = rpc_result_class(method.result, excd)
+            else:
+                stack.append(method.result)
+    return result
+
 
+def _create_rpc_result_class(datad, excd=None):
     class RpcResult(pdef.Message):
         data = pdef.descriptors.field('data', datad)
         error = pdef.descriptors.field('error', excd or pdef.descriptors.string0)
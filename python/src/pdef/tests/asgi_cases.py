@@ -0,0 +1,170 @@
+# encoding: utf-8
+'''ASGI app tests, they require Python 3.5+ and are imported by test_aio.'''
+import asyncio
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from mock import Mock
+
+import pdef
+from pdef.aio import AsgiRpcApp
+from pdef.rpc import *
+from pdef.tests.messages.protocol import *
+from pdef.tests.interfaces.protocol import *
+
+
+class TestAsgiRpcApp(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _call(self, app, path, method='GET', query=b'', body=b'',
+              content_type=b'application/x-www-form-urlencoded'):
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+                 'headers': [(b'content-type', content_type)]}
+        messages = [{'type': 'http.request', 'body': body[:3], 'more_body': True},
+                    {'type': 'http.request', 'body': body[3:]}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(app(scope, receive, send))
+        status = sent[0]['status']
+        headers = dict(sent[0]['headers'])
+        content = b''.join(m.get('body', b'') for m in sent[1:])
+        return status, headers, content, sent
+
+    def _app(self, service, **kwargs):
+        app = AsgiRpcApp(rpc_handler(TestInterface, service), **kwargs)
+        self.addCleanup(app.close)
+        return app
+
+    def test_handle__sync_service(self):
+        service = Mock()
+        service.method = Mock(return_value=3)
+        service.interface0 = Mock(return_value=service)
+        app = self._app(service)
+
+        status, headers, content, _ = self._call(app, '/interface0/1/2/method',
+                                                 query=b'arg0=3&arg1=4')
+        assert status == 200
+        assert content == b'{"data":3}'
+        assert headers[b'content-length'] == b'10'
+        service.interface0.assert_called_with(arg0=1, arg1=2)
+        service.method.assert_called_with(arg0=3, arg1=4)
+
+    def test_handle__async_service(self):
+        calls = []
+
+        class Service(object):
+            async def method(self, arg0=None, arg1=None):
+                calls.append((arg0, arg1))
+                await asyncio.sleep(0)
+                return arg0 + arg1
+
+            async def interface0(self, arg0=None, arg1=None):
+                return self
+
+            async def exc0(self):
+                raise TestException('Test exception')
+
+        app = self._app(Service())
+        status, _, content, _ = self._call(app, '/interface0/1/2/method',
+                                           query=b'arg0=3&arg1=4')
+        assert status == 200
+        assert content == b'{"data":7}'
+        assert calls == [(3, 4)]
+
+        status, _, content, _ = self._call(app, '/exc0')
+        assert status == 422
+        assert json.loads(content.decode('utf-8')) == {'error': {'text': 'Test exception'}}
+
+    def test_handle__post(self):
+        service = Mock()
+        service.post = Mock(return_value=11)
+        app = self._app(service)
+
+        status, _, content, _ = self._call(app, '/post', method='POST',
+                                           body=b'arg0=5&arg1=6')
+        assert status == 200
+        assert content == b'{"data":11}'
+        service.post.assert_called_with(arg0=5, arg1=6)
+
+    def test_handle__rpc_exc(self):
+        status, headers, content, _ = self._call(self._app(Mock()), '/wrong')
+
+        assert status == 400
+        assert headers[b'content-type'] == b'text/plain; charset=utf-8'
+        assert content
+
+    def test_handle__stream(self):
+        service = Mock()
+        service.collections = Mock(return_value=list(range(1000)))
+        app = self._app(service, stream_threshold=128)
+
+        status, headers, content, sent = self._call(app, '/collections')
+        assert status == 200
+        assert b'content-length' not in headers
+        assert all(m.get('more_body') for m in sent[1:-1])
+        assert not sent[-1].get('more_body')
+        assert json.loads(content.decode('utf-8')) == {'data': list(range(1000))}
+
+    def test_handle_batch(self):
+        service = Mock()
+        service.method = Mock(side_effect=lambda arg0, arg1: arg0 + arg1)
+        service.exc0 = Mock(side_effect=ValueError('Unexpected'))
+        app = self._app(service)
+
+        body = json.dumps([{'path': '/method', 'query': {'arg0': '1', 'arg1': '2'}},
+                           {'path': '/wrong'},
+                           {'path': '/exc0'},
+                           {'path': '/method', 'query': {'arg0': '3', 'arg1': '4'}}])
+        status, _, content, _ = self._call(app, '/', method='POST', body=body.encode('utf-8'),
+                                           content_type=b'application/json')
+        assert status == 200
+
+        results = json.loads(content.decode('utf-8'))
+        assert results[0] == {'status': 200, 'data': 3}
+        assert results[1]['status'] == 400
+        assert results[2] == {'status': 500, 'message': 'Internal server error'}
+        assert results[3] == {'status': 200, 'data': 7}
+
+    def test_executor__bounded(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        service = Mock()
+        service.method = Mock(return_value=1)
+        app = AsgiRpcApp(rpc_handler(TestInterface, service), executor=executor)
+
+        assert self._call(app, '/method')[0] == 200
+        app.close()
+        assert app.executor is executor
+        assert executor.submit(lambda: 2).result() == 2
+
+    def test_lifespan(self):
+        app = self._app(Mock())
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        self.loop.run_until_complete(app({'type': 'lifespan'}, receive, send))
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+    def test_asgi_app(self):
+        app = pdef.asgi_app(rpc_handler(TestInterface, Mock()), max_workers=2)
+        self.addCleanup(app.close)
+
+        assert isinstance(app, AsgiRpcApp)
+        assert app.executor._max_workers == 2
@@ -0,0 +1,267 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+import copy
+import sys
+import unittest
+from threading import Thread
+
+from mock import Mock
+
+import pdef
+from pdef.rpc import *
+from pdef.tests.messages.protocol import *
+from pdef.tests.interfaces.protocol import *
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from pdef.aio import AsyncRpcClient, AsyncTransport, HttpResponse, StreamTransport
+    # ASGI tests use the async syntax which does not compile on Python 2.
+    from pdef.tests.asgi_cases import TestAsgiRpcApp
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio client requires Python 3.5+')
+class TestAsyncRpcClient(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _client(self, response):
+        transport = Mock(spec=AsyncTransport)
+        transport.send = Mock(side_effect=lambda *args, **kwargs: self._result(response))
+        return AsyncRpcClient(TestInterface, 'http://localhost:8080', transport=transport)
+
+    def _result(self, value):
+        future = self.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def test_build_request(self):
+        client = self._client(None)
+        request = RpcRequest(POST, path='/method/', query={'a': '1'}, post={'key': 'value'})
+
+        method, url, headers, body = client._build_request(request)
+        assert method == POST
+        assert url == 'http://localhost:8080/method/?a=1'
+        assert headers == {'Content-Type': FORM_URLENCODED_MIME_TYPE}
+        assert body == b'key=value'
+
+    def test_call(self):
+        content = rpc_result_class(descriptors.int32)(3).to_json().encode('utf-8')
+        client = self._client(HttpResponse(200, content=content))
+
+        result = self.loop.run_until_complete(client.proxy().method(1, 2))
+        assert result == 3
+
+        (method, url), kwargs = client.transport.send.call_args
+        assert method == GET
+        assert url == 'http://localhost:8080/method?arg0=1&arg1=2'
+
+    def test_call__none_primitive_to_default(self):
+        content = rpc_result_class(descriptors.int32)().to_json().encode('utf-8')
+        client = self._client(HttpResponse(200, content=content))
+
+        assert self.loop.run_until_complete(client.proxy().method()) == 0
+
+    def test_call__protocol_jsonformat(self):
+        jsonformat = pdef.formats.JsonFormat()
+        jsonformat.read_bytes = Mock(wraps=jsonformat.read_bytes)
+        content = rpc_result_class(descriptors.int32)(3).to_json().encode('utf-8')
+        client = self._client(HttpResponse(200, content=content))
+        client.protocol = RpcProtocol(jsonformat)
+
+        assert self.loop.run_until_complete(client.proxy().method(1, 2)) == 3
+        assert jsonformat.read_bytes.call_count == 1
+
+    def test_call__application_exc(self):
+        exc = TestException('hello')
+        content = rpc_result_class(descriptors.int32, TestException.descriptor)(error=exc)
+        client = self._client(HttpResponse(422, content=content.to_json().encode('utf-8')))
+
+        coro = client.proxy().exc0()
+        self.assertRaises(TestException, self.loop.run_until_complete, coro)
+
+    def test_call__server_error(self):
+        client = self._client(HttpResponse(500, content=b'Internal server error'))
+
+        coro = client.proxy().method()
+        self.assertRaises(RpcException, self.loop.run_until_complete, coro)
+
+    def test_map(self):
+        resultd = rpc_result_class(descriptors.int32, TestException.descriptor)
+        responses = {'1': HttpResponse(200, content=resultd(3).to_json().encode('utf-8')),
+                     '3': HttpResponse(422, content=resultd(error=TestException('hello'))
+                                       .to_json().encode('utf-8')),
+                     '5': HttpResponse(200, content=resultd().to_json().encode('utf-8'))}
+        client = self._client(None)
+        # Concurrent calls are not sent in order, respond by the first argument.
+        client.transport.send.side_effect = lambda method, url, **kwargs: \
+            self._result(responses[url.split('arg0=')[1][0]])
+
+        proxy = pdef.proxy(TestInterface, lambda invocation: invocation)
+        invocations = [proxy.method(1, 2), proxy.method(3, 4), proxy.method(5, 6)]
+        results = self.loop.run_until_complete(client.map(invocations, max_concurrency=1))
+
+        assert [result.data for result in results] == [3, 0, 0]
+        assert results[1].error == TestException('hello')
+        assert not results[1].has_data
+        assert not results[2].has_error
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio client requires Python 3.5+')
+class TestStreamTransport(unittest.TestCase):
+    RESPONSE = (b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/plain\r\n'
+                b'Content-Length: 5\r\n\r\nhello')
+    CHUNKED_RESPONSE = (b'HTTP/1.1 200 OK\r\n'
+                        b'Transfer-Encoding: chunked\r\n\r\n'
+                        b'3\r\nhel\r\n2;ext\r\nlo\r\n0\r\n\r\n')
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.connections = []
+        self.requests = []
+        self.server = self.loop.run_until_complete(
+            self.loop.create_server(lambda: _HttpServerProtocol(self), 'localhost', 0))
+        self.url = 'http://localhost:%s' % self.server.sockets[0].getsockname()[1]
+        self.response = self.RESPONSE
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def _send(self, transport, method='GET', body=None):
+        coro = transport.send(method, self.url + '/path?q=1', {'X-Test': '1'}, body)
+        return self.loop.run_until_complete(coro)
+
+    def test_send(self):
+        transport = StreamTransport()
+        response = self._send(transport, POST, b'a=b')
+
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'text/plain'
+        assert response.content == b'hello'
+
+        request = self.requests[0]
+        assert request.startswith(b'POST /path?q=1 HTTP/1.1\r\n')
+        assert b'X-Test: 1\r\n' in request
+        assert request.endswith(b'Content-Length: 3\r\n\r\na=b')
+        self.loop.run_until_complete(transport.close())
+
+    def test_send__chunked(self):
+        self.response = self.CHUNKED_RESPONSE
+        transport = StreamTransport()
+
+        assert self._send(transport).content == b'hello'
+        self.loop.run_until_complete(transport.close())
+
+    def test_keep_alive(self):
+        transport = StreamTransport()
+        self._send(transport)
+        self._send(transport)
+
+        assert len(self.requests) == 2
+        assert len(self.connections) == 1
+        self.loop.run_until_complete(transport.close())
+
+    def test_keep_alive__closed_by_server(self):
+        transport = StreamTransport()
+        self._send(transport)
+
+        self.connections[0].transport.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        response = self._send(transport)
+
+        assert response.content == b'hello'
+        assert len(self.connections) == 2
+        self.loop.run_until_complete(transport.close())
+
+    def test_connection_close(self):
+        self.response = self.RESPONSE.replace(b'\r\n\r\n', b'\r\nConnection: close\r\n\r\n')
+        transport = StreamTransport()
+        self._send(transport)
+        self._send(transport)
+
+        assert len(self.connections) == 2
+        self.loop.run_until_complete(transport.close())
+
+
+if sys.version_info >= (3, 5):
+    class _HttpServerProtocol(asyncio.Protocol):
+        '''Minimal keep-alive HTTP server which replies with a test response.'''
+
+        def __init__(self, test):
+            self.test = test
+            self.transport = None
+            self.buffer = b''
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.test.connections.append(self)
+
+        def data_received(self, data):
+            self.buffer += data
+            head, sep, rest = self.buffer.partition(b'\r\n\r\n')
+            if not sep:
+                return
+
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+
+            if len(rest) < length:
+                return
+
+            self.test.requests.append(head + sep + rest[:length])
+            self.buffer = rest[length:]
+            self.transport.write(self.test.response)
+            if b'Connection: close' in self.test.response:
+                self.transport.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio client requires Python 3.5+')
+class TestAsyncIntegration(unittest.TestCase):
+    def setUp(self):
+        from wsgiref.simple_server import make_server
+
+        self.service = Mock()
+        app = wsgi_app(rpc_handler(TestInterface, self.service))
+
+        self.server = make_server('localhost', 0, app)
+        self.server_thread = Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+
+        self.loop = asyncio.new_event_loop()
+        url = 'http://localhost:%s' % self.server.server_port
+        self.client = pdef.async_rpc_client(TestInterface, url)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test(self):
+        service = self.service
+        proxy = self.client.proxy()
+        message = TestMessage('Привет', True, -123)
+
+        service.method = Mock(return_value=3)
+        service.post = Mock(return_value=11)
+        service.message0 = Mock(return_value=copy.deepcopy(message))
+        service.interface0 = Mock(return_value=service)
+        service.exc0 = Mock(side_effect=TestException('Test exception'))
+
+        run = self.loop.run_until_complete
+        assert run(proxy.method(1, 2)) == 3
+        assert run(proxy.post(5, 6)) == 11
+        assert run(proxy.message0(message)) == message
+        assert run(proxy.interface0(1, 2).method(3, 4)) == 3
+        self.assertRaises(TestException, run, proxy.exc0())
+
+        service.method.assert_called_with(arg0=3, arg1=4)
+        service.post.assert_called_with(arg0=5, arg1=6)
+        service.interface0.assert_called_with(arg0=1, arg1=2)
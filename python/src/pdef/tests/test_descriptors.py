@@ -29,6 +29,13 @@ class TestMessageDescriptor(unittest.TestCase):
         assert descriptor.fields == base.fields + descriptor.declared_fields
         assert len(descriptor.subtypes) == 0
 
+    def test_find_field(self):
+        descriptor = TestComplexMessage.descriptor
+
+        assert descriptor.find_field('string0') is TestMessage.string0
+        assert descriptor.find_field('list0') is TestComplexMessage.list0
+        assert descriptor.find_field('unknown') is None
+
     def test__polymorphic_inheritance(self):
         base = Base.descriptor
         subtype = Subtype.descriptor
@@ -143,6 +150,8 @@ class TestInterfaceDescriptor(unittest.TestCase):
         assert descriptor.base is base
         assert len(descriptor.methods) == (len(base.methods) + 1)
         assert descriptor.find_method('subMethod')
+        assert descriptor.find_method('method') is base.find_method('method')
+        assert descriptor.find_method('unknown') is None
         assert descriptor.exc is TestException.descriptor
 
 
@@ -196,6 +205,8 @@ class TestEnumDescriptor(unittest.TestCase):
         descriptor = TestEnum.descriptor
         assert descriptor.find_value('one') == TestEnum.ONE
         assert descriptor.find_value('TWO') == TestEnum.TWO
+        assert descriptor.find_value('tHree') == TestEnum.THREE
+        assert descriptor.find_value('four') is None
 
 
 class TestListDescriptor(unittest.TestCase):
@@ -215,3 +226,35 @@ class TestMapDescriptor(unittest.TestCase):
         map0 = descriptors.map0(descriptors.string0, descriptors.int32)
         assert map0.key is descriptors.string0
         assert map0.value is descriptors.int32
+
+
+class TestFreeze(unittest.TestCase):
+    def test_module(self):
+        from pdef.tests.interfaces import protocol
+        descriptors.freeze(protocol)
+
+        descriptor = TestInterface.descriptor
+        method = descriptor.find_method('message0')
+        assert 'pyclass' in descriptor.__dict__
+        assert 'exc' in descriptor.__dict__
+        assert 'result' in method.__dict__
+        assert 'is_terminal' in method.__dict__
+        assert 'type' in method.args[0].__dict__
+
+        # Referenced descriptors from other modules.
+        assert 'type' in TestMessage.string0.__dict__
+        assert 'field_tuples' in TestMessage.descriptor.__dict__
+
+    def test_descriptor(self):
+        base = Base.descriptor
+        assert descriptors.freeze(base) is base
+
+        assert 'subtypes' in base.__dict__
+        assert 'pyclass' in MultiLevelSubtype.descriptor.__dict__
+        assert base.find_subtype(PolymorphicType.SUBTYPE) is Subtype.descriptor
+
+    def test_class(self):
+        descriptors.freeze(TestComplexMessage)
+
+        assert 'type' in TestComplexMessage.map0.__dict__
+        assert 'subtypes' in TestComplexMessage.descriptor.__dict__
@@ -1,13 +1,32 @@
 # encoding: utf-8
 from __future__ import unicode_literals
-from datetime import datetime
+import copy
+import gc
+import weakref
+from datetime import datetime, timedelta, tzinfo
+import json
+import sys
 import unittest
+from io import BytesIO, StringIO
+from mock import Mock, patch
 
-from pdef.formats import jsonformat
+import pdef
+
+from pdef.formats import jsonformat, binaryformat, BinaryFormat, JsonFormat, JsonBackend, \
+    StdlibJsonBackend, OrjsonBackend
 from pdef.tests.inheritance.protocol import *
 from pdef.tests.messages.protocol import *
 
 
+def assert_json_equal(actual, expected):
+    '''Assert JSON texts are equal ignoring the key order, Python 2 dicts are not ordered.'''
+    if isinstance(actual, bytes):
+        actual, expected = actual.decode('utf-8'), expected.decode('utf-8')
+
+    assert json.loads(actual) == json.loads(expected)
+    assert sorted(actual) == sorted(expected)  # The same whitespace and separators.
+
+
 class TestJsonFormat(unittest.TestCase):
     def _test(self, descriptor, parsed, serialized):
         assert jsonformat.write(parsed, descriptor) == serialized
@@ -43,6 +62,34 @@ class TestJsonFormat(unittest.TestCase):
     def test_datetime(self):
         self._test(descriptors.datetime0, datetime(2013, 11, 17, 19, 12), '"2013-11-17T19:12:00Z"')
 
+    def test_datetime__fractions_and_offsets(self):
+        read = lambda s: jsonformat.read('"%s"' % s, descriptors.datetime0)
+
+        assert read('2013-11-17T19:12:01') == datetime(2013, 11, 17, 19, 12, 1)
+        assert read('2013-11-17T19:12:01.5Z') == datetime(2013, 11, 17, 19, 12, 1, 500000)
+        assert read('2013-11-17T19:12:01.1234567Z') == datetime(2013, 11, 17, 19, 12, 1, 123456)
+        assert read('2013-11-17T19:12:01+03:00') == datetime(2013, 11, 17, 16, 12, 1)
+        assert read('2013-11-17T19:12:01-0130') == datetime(2013, 11, 17, 20, 42, 1)
+        assert read('2013-11-17T19:12:01+03') == datetime(2013, 11, 17, 16, 12, 1)
+
+    def test_datetime__invalid(self):
+        read = lambda s: jsonformat.read('"%s"' % s, descriptors.datetime0)
+
+        for s in ('', '2013-11-17', '2013-11-17 19:12', '2013-13-17T19:12:01Z',
+                  '2013-11-17T19:12:01.Z', '2013-11-17T19:12:01+3', '2013-11-17T19:12:01Zabc'):
+            self.assertRaises(ValueError, read, s)
+
+    def test_datetime__write_aware(self):
+        class Tz(tzinfo):
+            def utcoffset(self, dt):
+                return timedelta(hours=3)
+
+        dt = datetime(2013, 11, 17, 19, 12, tzinfo=Tz())
+        assert jsonformat.write(dt, descriptors.datetime0) == '"2013-11-17T16:12:00Z"'
+
+    def test_datetime__before_1900(self):
+        self._test(descriptors.datetime0, datetime(1, 2, 3, 4, 5, 6), '"0001-02-03T04:05:06Z"')
+
     def test_enum(self):
         self._test(TestEnum.descriptor, TestEnum.THREE, '"three"')
         assert jsonformat.read('"tWo"', TestEnum.descriptor) == TestEnum.TWO
@@ -68,6 +115,292 @@ class TestJsonFormat(unittest.TestCase):
     def test_void(self):
         self._test(descriptors.void, None, 'null')
 
+    def test_list__messages(self):
+        listd = descriptors.list0(TestMessage.descriptor)
+        messages = [TestMessage(string0='hello'), None, TestMessage(int0=1)]
+        s = jsonformat.write(messages, listd)
+
+        assert s == '[{"string0": "hello"}, null, {"int0": 1}]'
+        assert jsonformat.read(s, listd) == messages
+
+    def test_map__datetime_keys(self):
+        mapd = descriptors.map0(descriptors.datetime0, descriptors.bool0)
+        self._test(mapd, {datetime(2013, 11, 17): True}, '{"2013-11-17T00:00:00Z": true}')
+
+    def test_message__recursive(self):
+        class Node(pdef.Message):
+            child = descriptors.field('child', lambda: Node.descriptor)
+            descriptor = descriptors.message(lambda: Node, fields=[child])
+
+            def __init__(self, child=None):
+                self.child = child
+
+        node = Node(Node(Node()))
+        s = jsonformat.write(node, Node.descriptor)
+
+        assert s == '{"child": {"child": {}}}'
+        assert jsonformat.read(s, Node.descriptor) == node
+
+    def test_compiled_codecs_are_cached(self):
+        listd = descriptors.list0(TestMessage.descriptor)
+        object_format = jsonformat.object_format
+
+        assert object_format._writers.get(listd) is object_format._writers.get(listd)
+        assert object_format._readers.get(listd) is object_format._readers.get(listd)
+
+    def test_compiled_codecs_live_with_descriptors(self):
+        def create_class():
+            class Dynamic(pdef.Message):
+                field0 = descriptors.field('field0', descriptors.int32)
+                descriptor = descriptors.message(lambda: Dynamic, fields=[field0])
+
+            return Dynamic
+
+        cls = create_class()
+        msg = jsonformat.read('{"field0": 1}', cls.descriptor)
+        assert jsonformat.write(msg, cls.descriptor) == '{"field0": 1}'
+        assert binaryformat.read(binaryformat.write(msg, cls.descriptor), cls.descriptor) == msg
+
+        ref = weakref.ref(cls.descriptor)
+        del cls, msg
+        gc.collect()
+        assert ref() is None
+
+    def test_compiled_codecs_live_with_formats(self):
+        descriptor = TestComplexMessage.descriptor
+        message = self._complex_message()
+        lazy = JsonFormat().read(message.to_json(), descriptor, lazy=True)
+
+        gc.collect()
+        size = len(descriptor._pdef_codecs)
+
+        refs = []
+        for i in range(10):
+            format0 = JsonFormat()
+            format0.write(message, descriptor)
+            ''.join(format0.iter_json(message, descriptor, indent=i))
+            format0.read(format0.write(message, descriptor), descriptor, lazy=True)
+
+            binary = BinaryFormat()
+            binary.read(binary.write(message, descriptor), descriptor)
+            refs += [weakref.ref(format0), weakref.ref(binary)]
+
+        del format0, binary
+        gc.collect()
+        assert all(ref() is None for ref in refs)
+        assert len(descriptor._pdef_codecs) == size
+
+        # Lazy messages keep their format until all fields are decoded.
+        gc.collect()
+        assert lazy == message
+
+    def test_iter_json(self):
+        message = self._complex_message()
+        expected = json.dumps(message.to_dict(), ensure_ascii=False)
+
+        assert_json_equal(''.join(message.iter_json()), expected)
+
+    def test_iter_json__indent(self):
+        message = self._complex_message()
+        message.list0 = []
+        message.map0 = {}
+
+        # Python 2 json supports only integer indents.
+        indents = (True, 2, '\t') if sys.version_info >= (3, 0) else (True, 2)
+        for indent in indents:
+            expected = json.dumps(message.to_dict(), ensure_ascii=False, indent=indent,
+                                  separators=(',', ': '))
+            assert_json_equal(''.join(message.iter_json(indent=indent)), expected)
+
+    def test_iter_json__list(self):
+        listd = descriptors.list0(MultiLevelSubtype.descriptor)
+        messages = [self._polymorphic_message(), None, self._polymorphic_message()]
+        expected = jsonformat.write(messages, listd)
+
+        assert_json_equal(''.join(jsonformat.iter_json(messages, listd)), expected)
+        assert ''.join(jsonformat.iter_json(None, listd)) == 'null'
+
+    def test_iter_json__compact(self):
+        message = self._complex_message()
+        expected = jsonformat.write_bytes(message, message.descriptor, compact=True)
+
+        assert_json_equal(''.join(jsonformat.iter_json(message, message.descriptor, compact=True)),
+                          expected.decode('utf-8'))
+
+        lazy = TestComplexMessage.from_json(message.to_json(), lazy=True)
+        assert_json_equal(''.join(jsonformat.iter_json(lazy, lazy.descriptor, compact=True)),
+                          expected.decode('utf-8'))
+
+    def test_iter_bytes(self):
+        listd = descriptors.list0(TestMessage.descriptor)
+        messages = [TestMessage('Привет', True, i) for i in range(100)]
+        chunks = list(JsonFormat(buffer_size=256).iter_bytes(messages, listd))
+
+        assert len(chunks) > 1
+        assert all(len(chunk) < 512 for chunk in chunks)
+        assert_json_equal(b''.join(chunks), jsonformat.write_bytes(messages, listd))
+
+    def test_write_to_stream(self):
+        listd = descriptors.list0(TestComplexMessage.descriptor)
+        messages = [self._complex_message() for i in range(100)]
+
+        fp = Mock(wraps=StringIO())
+        JsonFormat(buffer_size=1024).write_to_stream(messages, listd, fp)
+
+        assert fp.write.call_count > 1
+        assert_json_equal(''.join(c[0][0] for c in fp.write.call_args_list),
+                          jsonformat.write(messages, listd))
+
+    def test_iter_stream(self):
+        listd = descriptors.list0(TestComplexMessage.descriptor)
+        messages = [self._complex_message() for i in range(10)]
+        s = jsonformat.write(messages, listd, indent=2)
+
+        format0 = JsonFormat(buffer_size=7)
+        assert list(format0.iter_stream(StringIO(s), listd)) == messages
+        assert list(format0.iter_stream(BytesIO(s.encode('utf-8')), listd)) == messages
+
+    def test_iter_stream__numbers_across_chunks(self):
+        listd = descriptors.list0(descriptors.int64)
+        format0 = JsonFormat(buffer_size=2)
+
+        assert list(format0.iter_stream(StringIO('[12345, 6789 ,0]'), listd)) == [12345, 6789, 0]
+
+    def test_iter_stream__empty_and_null(self):
+        listd = descriptors.list0(descriptors.int32)
+
+        assert list(jsonformat.iter_stream(StringIO(' [ ] '), listd)) == []
+        assert list(jsonformat.iter_stream(StringIO('null'), listd)) == []
+
+    def test_iter_stream__invalid(self):
+        listd = descriptors.list0(descriptors.int32)
+        read = lambda s: list(JsonFormat(buffer_size=2).iter_stream(StringIO(s), listd))
+
+        self.assertRaises(ValueError, read, '{"a": 1}')
+        self.assertRaises(ValueError, read, '[1, 2')
+        self.assertRaises(ValueError, read, '[1 2]')
+        self.assertRaises(ValueError, jsonformat.iter_stream, StringIO('1'), descriptors.int32)
+
+    def test_iter_stream__truncated_tokens(self):
+        listd = descriptors.list0(descriptors.string0)
+        s = '["\\ud83d\\ude00", "%s", "x\\u0041"]' % ('a' * 100)
+        read = lambda size: list(JsonFormat(buffer_size=size).iter_stream(StringIO(s), listd))
+
+        expected = ['\U0001f600', 'a' * 100, 'xA']
+        for size in range(1, 20):
+            assert read(size) == expected
+
+    def test_iter_stream__errors_without_position(self):
+        # Python 2 decode errors are plain ValueErrors without positions.
+        raw_decode = pdef.formats._decoder.raw_decode
+
+        def decode(s, idx=0):
+            try:
+                return raw_decode(s, idx)
+            except ValueError as e:
+                raise ValueError(str(e))
+
+        listd = descriptors.list0(TestComplexMessage.descriptor)
+        messages = [self._complex_message() for i in range(10)]
+        s = jsonformat.write(messages, listd)
+
+        with patch.object(pdef.formats._decoder, 'raw_decode', decode):
+            for size in (16, 64):
+                format0 = JsonFormat(buffer_size=size)
+                assert list(format0.iter_stream(StringIO(s), listd)) == messages
+
+            read = lambda s: list(JsonFormat(buffer_size=16).iter_stream(StringIO(s), listd))
+            self.assertRaises(ValueError, read, '[{"int0": tru}]')
+
+    @unittest.skipIf(not hasattr(json, 'JSONDecodeError'), 'requires JSON error positions')
+    def test_iter_stream__invalid_element_fails_fast(self):
+        listd = descriptors.list0(TestMessage.descriptor)
+        stream = StringIO('[{"int0": 1}, {"int0": tru}, ' + '{"int0": 2}, ' * 10000 + '{}]')
+        items = JsonFormat(buffer_size=64).iter_stream(stream, listd)
+
+        assert next(items) == TestMessage(int0=1)
+        self.assertRaises(ValueError, next, items)
+        assert stream.tell() < 1024
+
+    def test_read__lazy(self):
+        msg0 = self._complex_message()
+        result = TestComplexMessage.from_json(msg0.to_json(), lazy=True)
+
+        assert result._string0 is None
+        assert result.has_message0
+        assert result.message0 == msg0.message0
+        assert result._message0 == msg0.message0
+        assert result.polymorphic == msg0.polymorphic
+        assert result == msg0
+
+    def test_read__lazy_set_field(self):
+        result = TestComplexMessage.from_json(self._complex_message().to_json(), lazy=True)
+        result.string0 = None
+        result.int0 = 1
+
+        assert not result.has_string0
+        assert result.int0 == 1
+        assert 'string0' not in result.to_dict()
+
+    def test_read__lazy_invalid_field(self):
+        result = TestComplexMessage.from_json('{"datetime0": "garbage", "int0": 5}', lazy=True)
+
+        self.assertRaises(ValueError, lambda: result.datetime0)
+        self.assertRaises(ValueError, lambda: result.datetime0)
+        assert result.has_datetime0
+        assert result.int0 == 5
+        assert json.loads(result.to_json()) == {'int0': 5, 'datetime0': 'garbage'}
+
+    def test_read__lazy_polymorphic(self):
+        msg0 = self._polymorphic_message()
+        result = Base.from_json(msg0.to_json(), lazy=True)
+
+        assert isinstance(result, MultiLevelSubtype)
+        assert result == msg0
+
+    def test_write__lazy_untouched_fields(self):
+        msg0 = self._complex_message()
+        result = TestComplexMessage.from_json(msg0.to_json(), lazy=True)
+        assert result.string0 == 'hello'
+
+        indented = jsonformat.write(msg0, msg0.descriptor, indent=2, separators=(',', ': '))
+        assert_json_equal(result.to_json(), msg0.to_json())
+        assert_json_equal(''.join(result.iter_json()), msg0.to_json())
+        assert_json_equal(''.join(result.iter_json(indent=2)), indented)
+        assert result._message0 is None
+        assert result.to_bytes() == msg0.to_bytes()
+
+    def test_write__lazy_to_dict_copies_untouched_fields(self):
+        msg0 = self._complex_message()
+        result = TestComplexMessage.from_json(msg0.to_json(), lazy=True)
+
+        d = result.to_dict()
+        d['list0'].append(99)
+        d['message0']['int0'] = 1
+        d['polymorphic']['field'] = 'changed'
+
+        assert result.list0 == [1, 2]
+        assert result.message0.int0 == 16
+        assert result == msg0
+
+    def test_lazy__concurrent_detach(self):
+        result = TestMessage.from_json('{"int0": 1}', lazy=True)
+        lazy = result._pdef_lazy
+
+        # Two threads decode the last field at the same time.
+        lazy.decode(result, 'int0')
+        lazy._detach(result)
+        assert result.int0 == 1
+        assert result._pdef_lazy is None
+
+    def test_lazy__copy_and_merge(self):
+        msg0 = self._complex_message()
+        result = TestComplexMessage.from_json(msg0.to_json(), lazy=True)
+
+        assert copy.deepcopy(result) == msg0
+        assert TestComplexMessage().merge(
+            TestComplexMessage.from_json(msg0.to_json(), lazy=True)) == msg0
+
     def _complex_message(self):
         return TestComplexMessage(
             string0="hello",
@@ -96,3 +429,173 @@ class TestJsonFormat(unittest.TestCase):
             field='field',
             subfield='subfield',
             mfield='mfield')
+
+
+class TestJsonBackends(unittest.TestCase):
+    def _test(self, format0):
+        message = TestComplexMessage(string0='привет', datetime0=datetime(2013, 11, 17),
+                                     list0=[1, 2], map0={1: 1.5}, message0=TestMessage(int0=1))
+        descriptor = TestComplexMessage.descriptor
+
+        assert format0.read(format0.write(message, descriptor), descriptor) == message
+        assert format0.read_bytes(format0.write_bytes(message, descriptor), descriptor) == message
+        assert format0.read_stream(BytesIO(format0.write_bytes(message, descriptor)),
+                                   descriptor) == message
+
+    def test_stdlib(self):
+        format0 = JsonFormat()
+
+        assert isinstance(format0.backend, StdlibJsonBackend)
+        assert format0.write_bytes('привет', descriptors.string0) == '"привет"'.encode('utf-8')
+        self._test(format0)
+
+    def test_orjson(self):
+        try:
+            import orjson
+        except ImportError:
+            return
+
+        format0 = JsonFormat(backend='orjson')
+        assert format0.write(TestMessage(string0='привет'), TestMessage.descriptor) \
+            == '{"string0":"привет"}'
+        self._test(format0)
+
+    def test_auto(self):
+        format0 = JsonFormat(backend='auto')
+
+        assert isinstance(format0.backend, (StdlibJsonBackend, OrjsonBackend))
+        self._test(format0)
+
+    def test_custom(self):
+        class Backend(JsonBackend):
+            def loads(self, s):
+                return json.loads(s)
+
+            def dumps(self, obj, indent=None, **kwargs):
+                return json.dumps(obj, indent=indent, sort_keys=True)
+
+        format0 = JsonFormat(backend=Backend())
+        assert format0.write({'b': 1, 'a': 2}, descriptors.map0(descriptors.string0,
+                                                                descriptors.int32)) \
+            == '{"a": 2, "b": 1}'
+        self._test(format0)
+
+    def test_write_bytes__compact(self):
+        class Backend(JsonBackend):
+            def loads(self, s):
+                return json.loads(s)
+
+            def dumps(self, obj, indent=None, **kwargs):
+                return json.dumps(obj, indent=indent)
+
+        for format0 in (JsonFormat(), JsonFormat(backend=Backend())):
+            message = TestMessage(string0='Привет', int0=1)
+            b = format0.write_bytes(message, TestMessage.descriptor, compact=True)
+
+            assert json.loads(b.decode('utf-8')) == message.to_dict()
+            assert format0.write_bytes(message, TestMessage.descriptor, compact=True, indent=2) \
+                == format0.write_bytes(message, TestMessage.descriptor, indent=2)
+
+        b = jsonformat.write_bytes(TestMessage(string0='Привет', int0=1), TestMessage.descriptor,
+                                   compact=True)
+        assert_json_equal(b, '{"string0":"Привет","int0":1}'.encode('utf-8'))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, JsonFormat, backend='unknown')
+
+
+class TestBinaryFormat(unittest.TestCase):
+    def _test(self, descriptor, parsed):
+        serialized = binaryformat.write(parsed, descriptor)
+
+        assert isinstance(serialized, bytes)
+        assert binaryformat.read(serialized, descriptor) == parsed
+
+    def test_primitives(self):
+        self._test(descriptors.bool0, True)
+        self._test(descriptors.bool0, False)
+        self._test(descriptors.int16, -16)
+        self._test(descriptors.int32, 2 ** 31 - 1)
+        self._test(descriptors.int64, -2 ** 63)
+        self._test(descriptors.float0, -1.5)
+        self._test(descriptors.double0, 0.1)
+        self._test(descriptors.string0, 'привет')
+        self._test(descriptors.datetime0, datetime(2013, 11, 17, 19, 12, 1, 5))
+        self._test(descriptors.datetime0, datetime(1900, 1, 1))
+        self._test(TestEnum.descriptor, TestEnum.THREE)
+
+    def test_varint(self):
+        assert binaryformat.write(1, descriptors.int32) == b'\x02'
+        assert binaryformat.write(-1, descriptors.int32) == b'\x01'
+        assert binaryformat.write(150, descriptors.int64) == b'\xac\x02'
+
+    def test_collections(self):
+        self._test(descriptors.list0(descriptors.string0), ['a', 'b', ''])
+        self._test(descriptors.set0(descriptors.int32), {1, 2, 3})
+        self._test(descriptors.map0(descriptors.string0, descriptors.list0(descriptors.int32)),
+                   {'a': [1, 2], 'b': []})
+
+    def test_message(self):
+        message = self._complex_message()
+        s = message.to_bytes()
+
+        assert TestComplexMessage.from_bytes(s) == message
+        assert len(s) < len(message.to_json().encode('utf-8')) / 2
+
+    def test_message__polymorphic(self):
+        message = MultiLevelSubtype(field='field', subfield='subfield', mfield='mfield')
+        s = binaryformat.write(message, Base.descriptor)
+
+        result = binaryformat.read(s, Base.descriptor)
+        assert isinstance(result, MultiLevelSubtype)
+        assert result == message
+
+    def test_message__skip_unknown_fields(self):
+        message = self._complex_message()
+        s = message.to_bytes()
+
+        result = TestMessage.from_bytes(s)
+        assert result == TestMessage(string0='hello', bool0=True, int0=32)
+
+    def test_stream(self):
+        message = self._complex_message()
+        fp = BytesIO()
+        binaryformat.write_to_stream(message, TestComplexMessage.descriptor, fp)
+
+        fp.seek(0)
+        assert binaryformat.read_stream(fp, TestComplexMessage.descriptor) == message
+
+    def test_none(self):
+        assert binaryformat.write(None, TestMessage.descriptor) is None
+        assert binaryformat.read(None, TestMessage.descriptor) is None
+        assert binaryformat.read(b'', TestMessage.descriptor) == TestMessage()
+
+    def _complex_message(self):
+        return TestComplexMessage(
+            string0='hello',
+            bool0=True,
+            int0=32,
+            long0=-64,
+            double0=2.5,
+            datetime0=datetime(1970, 1, 1, 0, 0, 0),
+            enum0=TestEnum.THREE,
+            list0=[1, 2],
+            map0={1: 1.5},
+            message0=TestMessage(string0='привет'),
+            polymorphic=MultiLevelSubtype(field='field', mfield='mfield'))
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, binaryformat.read, b'\x80', descriptors.int32)
+        self.assertRaises(ValueError, binaryformat.read, b'\x0a\x05ab', TestMessage.descriptor)
+
+    def test_malformed__nested_boundary(self):
+        # A message0 field of 4 bytes, its string length points past it into the int0 fields.
+        data = b'\x6a\x04\x0a\x05ab' + b'\x18\x01\x18\x01'
+        self.assertRaises(ValueError, binaryformat.read, data, TestComplexMessage.descriptor)
+
+        # A message0 field length points past the data.
+        self.assertRaises(ValueError, binaryformat.read, b'\x6a\x09\x18\x01',
+                          TestComplexMessage.descriptor)
+
+    def test_malformed__enum_index(self):
+        self.assertRaises(ValueError, binaryformat.read, b'\x7f', TestEnum.descriptor)
@@ -91,6 +91,7 @@ class TestInvocation(unittest.TestCase):
 
         assert build([1, 2], None) == expected
         assert build(None, {'a': 1, 'b': 2}) == expected
+        assert build(None, {'b': 2, 'a': 1}) == expected
         assert build([1], {'b': 2}) == expected
         assert build(None, None) == {'a': None, 'b': None}
 
@@ -121,6 +122,27 @@ class TestInvocation(unittest.TestCase):
         assert arg0[0] is not list0[0]
         assert arg0[1] is not list0[1]
 
+    def test_copy_args__disabled(self):
+        method = descriptors.method('method', descriptors.void,
+            args=(descriptors.arg('arg0', descriptors.list0(TestMessage.descriptor)), ))
+        list0 = [TestMessage('hello')]
+
+        invocation = Invocation(method, args=(list0, ), copy_args=False)
+        assert invocation.kwargs['arg0'] is list0
+
+    def test_trusted(self):
+        method0 = descriptors.method('method0', descriptors.interface(object))
+        method1 = descriptors.method('method1', descriptors.void,
+            args=(descriptors.arg('arg0', descriptors.list0(descriptors.int32)), ))
+        kwargs = {'arg0': [1, 2]}
+
+        invocation0 = Invocation(method0)
+        invocation1 = Invocation.trusted(method1, kwargs, parent=invocation0)
+
+        assert invocation1.method is method1
+        assert invocation1.parent is invocation0
+        assert invocation1.kwargs is kwargs
+
 
 class TestInvocationProxy(unittest.TestCase):
     def proxy(self):
@@ -189,3 +211,19 @@ class TestInvocationProxy(unittest.TestCase):
 
         assert invocation1.method.name == 'query'
         assert invocation1.kwargs == {'arg0': None, 'arg1': None}
+
+    def test_copy_args__disabled(self):
+        msg = TestMessage('hello')
+        proxy0 = proxy(TestInterface, lambda inv: inv, copy_args=False)
+
+        invocation = proxy0.interface0(1, 2).message0(msg)
+        assert invocation.kwargs['msg'] is msg
+
+    def test_proxy_method__cached(self):
+        proxy0 = InvocationProxy(TestInterface.descriptor, lambda inv: inv)
+
+        assert proxy0.method is proxy0.method
+        assert proxy0.interface0() is proxy0.interface0()
+        assert proxy0.interface0().method is proxy0.interface0().method
+        assert proxy0.interface0(1, 2) is not proxy0.interface0(1, 2)
+        assert proxy0.interface0(1, 2).query().parent.kwargs == {'arg0': 1, 'arg1': 2}
@@ -2,7 +2,12 @@
 from __future__ import unicode_literals
 
 import copy
+import gc
+import json
+import socket
+import time
 import unittest
+import weakref
 from datetime import datetime
 from io import BytesIO
 
@@ -15,6 +20,12 @@ from pdef.rpc import *
 from pdef.tests.messages.protocol import *
 from pdef.tests.interfaces.protocol import *
 
+try:
+    import concurrent.futures as futures
+except ImportError:
+    # Python 2.7 requires the futures package.
+    futures = None
+
 
 class TestRpcProtocol(unittest.TestCase):
     def setUp(self):
@@ -88,6 +99,50 @@ class TestRpcProtocol(unittest.TestCase):
 
         assert result == 'one'
 
+    def test_text_codecs__match_json(self):
+        jsonformat = pdef.jsonformat
+        values = [(descriptors.bool0, [True, False]),
+                  (descriptors.int16, [0, -16]),
+                  (descriptors.int32, [2 ** 31 - 1, -32]),
+                  (descriptors.int64, [2 ** 63 - 1, -64]),
+                  (descriptors.float0, [-1.5, 0.1]),
+                  (descriptors.double0, [1e100, 2.5, float('inf')]),
+                  (descriptors.string0, ['', 'Привет', 'a"b\\c\n', 'end"']),
+                  (descriptors.datetime0, [datetime(2013, 11, 17, 19, 41)]),
+                  (TestEnum.descriptor, [TestEnum.ONE]),
+                  (descriptors.list0(descriptors.int32), [[1, 2]]),
+                  (TestMessage.descriptor, [TestMessage('Привет', True, 1)])]
+
+        for descriptor, vv in values:
+            encode, decode = self.protocol.get_text_codec(descriptor)
+            for value in vv:
+                s = encode(value)
+                json = jsonformat.write(value, descriptor)
+                assert s == (json[1:-1] if json.startswith('"') else json), (descriptor, value)
+                assert decode(s) == value
+                assert decode(json) == value
+
+    def test_text_codecs__cached(self):
+        codec = self.protocol.get_text_codec(descriptors.int32)
+
+        assert RpcProtocol().get_text_codec(descriptors.int32) is codec
+
+    def test_text_codecs__do_not_keep_formats(self):
+        refs = []
+        for descriptor in (descriptors.int32, descriptors.datetime0, TestMessage.descriptor):
+            jsonformat = pdef.formats.JsonFormat()
+            protocol = RpcProtocol(jsonformat)
+            encode, decode = protocol.get_text_codec(descriptor)
+            refs.append(weakref.ref(jsonformat))
+
+        del jsonformat, protocol, encode, decode
+        gc.collect()
+        assert all(ref() is None for ref in refs)
+
+    def test_from_json__lenient_numbers(self):
+        assert self.protocol._from_json('1.0', descriptors.int32) == 1
+        assert self.protocol._from_json('1', descriptors.bool0) is True
+
     # get_invocation.
 
     def test_get_invocation(self):
@@ -132,6 +187,43 @@ class TestRpcProtocol(unittest.TestCase):
         assert invocation1.method.name == 'query'
         assert invocation1.kwargs == {'arg0': 3, 'arg1': None}
 
+    def test_get_invocation__deep_chain(self):
+        request = RpcRequest(path='/interface0/1/2/interface0/3/4/interface0/5/6/method',
+                             query={'arg0': '7'})
+        routes = self.protocol.get_routes(TestInterface.descriptor)
+
+        chain = self.protocol.get_invocation(request, TestInterface.descriptor,
+                                             routes=routes).to_chain()
+        assert [inv.method.name for inv in chain] == ['interface0'] * 3 + ['method']
+        assert [inv.kwargs for inv in chain] == [{'arg0': 1, 'arg1': 2}, {'arg0': 3, 'arg1': 4},
+                                                 {'arg0': 5, 'arg1': 6}, {'arg0': 7, 'arg1': None}]
+
+    def test_get_invocation__wrong_number_of_path_args(self):
+        request = RpcRequest(path='/interface0/1')
+        try:
+            self.protocol.get_invocation(request, TestInterface.descriptor)
+            self.fail()
+        except RpcException as e:
+            assert e.status == http_codes.NOT_FOUND
+
+    def test_get_invocation__parts_after_terminal_method(self):
+        request = RpcRequest(path='/method/1')
+        try:
+            self.protocol.get_invocation(request, TestInterface.descriptor)
+            self.fail()
+        except RpcException as e:
+            assert e.status == http_codes.BAD_REQUEST
+
+    def test_get_routes(self):
+        routes = self.protocol.get_routes(TestSubInterface.descriptor)
+        interface0 = routes['interface0']
+
+        assert 'subMethod' in routes
+        assert routes['post'].is_post
+        assert interface0.is_interface
+        assert interface0.next['interface0'].next is interface0.next
+        assert 'subMethod' not in interface0.next
+
     def test_get_invocation__last_method_not_terminal(self):
         request = RpcRequest(path='/interface0/1/2')
 
@@ -155,6 +247,53 @@ class TestRpcProtocol(unittest.TestCase):
         assert invocation.method.name == 'string0'
         assert invocation.kwargs == {'text': 'Привет/мир'}
 
+    # batches.
+
+    def test_batch_request(self):
+        invocations = [self.proxy.method(1, 2), self.proxy.interface0(1, 2).post(3, 4)]
+        s = self.protocol.write_batch_request(invocations)
+        requests0 = self.protocol.read_batch_request(s.encode('utf-8'))
+
+        assert [(r.method, r.path, r.query, r.post) for r in requests0] == [
+            (GET, '/method', {'arg0': '1', 'arg1': '2'}, {}),
+            (POST, '/interface0/1/2/post', {}, {'arg0': '3', 'arg1': '4'})]
+
+    def test_batch_request__malformed(self):
+        read = self.protocol.read_batch_request
+
+        self.assertRaises(ValueError, read, '')
+        self.assertRaises(ValueError, read, '{}')
+        self.assertRaises(ValueError, read, '[1]')
+        self.assertRaises(ValueError, read, '[{"method": "PUT", "path": "/method"}]')
+        self.assertRaises(ValueError, read, '[{"path": "/method", "query": {"arg0": 1}}]')
+
+    def test_batch_response(self):
+        result_class = rpc_result_class(descriptors.int32, TestException.descriptor)
+        results = [(http_codes.OK, result_class(3)),
+                   (http_codes.UNPROCESSABLE_ENTITY, result_class(error=TestException('e'))),
+                   (http_codes.NOT_FOUND, 'Method not found')]
+        b = self.protocol.write_batch_response(results)
+        invocations = [self.proxy.method(1, 2)] * 3
+        parsed = self.protocol.read_batch_response(b, invocations,
+                                                   TestException.descriptor)
+
+        assert parsed[0].data == 3
+        assert parsed[1].error == TestException('e')
+        assert isinstance(parsed[2], RpcException)
+        assert parsed[2].status == http_codes.NOT_FOUND
+        assert parsed[2].message == 'Method not found'
+
+    def test_batch_response__malformed(self):
+        invocations = [self.proxy.method(1, 2)] * 2
+
+        for b in (b'{}', b'[{"status": 200, "data": 1}]', b'[{"status": 200, "data": 1}, 1]',
+                  b'[null, {"status": 200}]'):
+            try:
+                self.protocol.read_batch_response(b, invocations)
+                self.fail()
+            except RpcException as e:
+                assert e.message == 'Malformed batch response'
+
     # from_json.
 
     def test_from_json(self):
@@ -193,6 +332,27 @@ class TestRpcClient(unittest.TestCase):
         result = self.client._parse_response(response, descriptors.int32)
         assert result == 123
 
+    def test_parse_response__content_bytes(self):
+        response = Mock(spec=['status_code', 'content'])
+        response.status_code = http_codes.OK
+        response.content = '{"data": "Привет"}'.encode('utf-8')
+
+        result = self.client._parse_response(response, descriptors.string0)
+        assert result == 'Привет'
+
+    def test_parse_response__protocol_jsonformat(self):
+        jsonformat = pdef.formats.JsonFormat()
+        jsonformat.read_bytes = Mock(wraps=jsonformat.read_bytes)
+        client = RpcClient(TestInterface, 'http://localhost:8080', session=self.session,
+                           protocol=RpcProtocol(jsonformat))
+
+        response = Mock(spec=['status_code', 'content'])
+        response.status_code = http_codes.OK
+        response.content = b'{"data": 123}'
+
+        assert client._parse_response(response, descriptors.int32) == 123
+        assert jsonformat.read_bytes.call_count == 1
+
     def test_parse_response__application_exc(self):
         exc = TestException('Test exception')
         response = requests.Response()
@@ -217,6 +377,80 @@ class TestRpcClient(unittest.TestCase):
             assert e.status == http_codes.NOT_FOUND
             assert e.message == 'Method not found'
 
+    @unittest.skipIf(futures is None, 'requires concurrent.futures')
+    def test_map__executor_waits_for_all(self):
+        completed = []
+
+        def invoke(invocation):
+            if invocation == 'fail':
+                raise ValueError('Unexpected')
+            time.sleep(0.1)
+            completed.append(invocation)
+
+        self.client._invoke_result = invoke
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertRaises(ValueError, self.client.map, ['fail', 'slow'], executor=executor)
+            assert completed == ['slow']
+
+    def test_send__timeout(self):
+        client = rpc_client(TestInterface, 'http://localhost:8080', session=self.session,
+                            timeout=(1, 5))
+        client._parse_response = Mock(return_value=3)
+        invocation = pdef.proxy(TestInterface, lambda inv: inv).method(1, 2)
+
+        assert client(invocation) == 3
+        assert self.session.send.call_args[1] == {'timeout': (1, 5)}
+
+    def test_pool__shared(self):
+        pool = http_pool(timeout=3)
+        client0 = rpc_client(TestInterface, 'http://localhost:8080', pool=pool)
+        client1 = rpc_client(TestInterface, 'http://localhost:8080', pool=pool)
+
+        assert client0.session is pool.session
+        assert client1.session is pool.session
+        assert client0.timeout == 3
+
+    def test_pool__default(self):
+        client0 = rpc_client(TestInterface, 'http://localhost:8080')
+        client1 = rpc_client(TestInterface, 'http://localhost:8080')
+
+        assert client0.pool is not client1.pool
+        assert client0.session is client0.pool.session
+
+    def test_pool__prewarm(self):
+        # The connections are established in the listen backlog, they are not accepted.
+        server = socket.socket()
+        server.bind(('localhost', 0))
+        server.listen(10)
+        server.settimeout(1)
+        pool = http_pool(pool_maxsize=3, timeout=5)
+        try:
+            url = 'http://localhost:%s' % server.getsockname()[1]
+            assert pool.prewarm(url, 5) == 3
+
+            accepted = [server.accept()[0] for _ in range(3)]
+            self.assertRaises(socket.timeout, server.accept)
+            for conn in accepted:
+                conn.close()
+        finally:
+            pool.close()
+            server.close()
+
+    def test_pool__prewarm_host_down(self):
+        server = socket.socket()
+        server.bind(('localhost', 0))
+        port = server.getsockname()[1]
+        server.close()
+
+        pool = http_pool()
+        assert pool.prewarm('http://localhost:%s' % port, 2) == 0
+
+    def test_pool__no_keep_alive(self):
+        pool = http_pool(keep_alive=False)
+
+        assert pool.session.headers['Connection'] == 'close'
+        assert pool.prewarm('http://localhost:8080', 2) == 0
+
 
 class TestRpcHandler(unittest.TestCase):
     def setUp(self):
@@ -262,6 +496,27 @@ class TestRpcHandler(unittest.TestCase):
             pass
 
 
+class TestRpcResultClass(unittest.TestCase):
+    def test_cached(self):
+        listd = descriptors.list0(TestMessage.descriptor)
+        cls = rpc_result_class(listd, TestException.descriptor)
+
+        assert rpc_result_class(listd, TestException.descriptor) is cls
+        assert rpc_result_class(listd) is not cls
+        assert cls.data.type is listd
+        assert cls.error.type is TestException.descriptor
+
+    def test_rpc_result_classes(self):
+        descriptor = TestInterface.descriptor
+        classes = rpc_result_classes(descriptor)
+        method = descriptor.find_method('method')
+        chained = descriptor.find_method('interface0').result.find_method('query')
+
+        assert classes[method] is rpc_result_class(descriptors.int32, TestException.descriptor)
+        assert chained in classes
+        assert descriptor.find_method('interface0') not in classes
+
+
 class TestWsgiRpcServer(unittest.TestCase):
     def env(self):
         return {
@@ -285,6 +540,48 @@ class TestWsgiRpcServer(unittest.TestCase):
                                           [('Content-Type', 'application/json; charset=utf-8'),
                                            ('Content-Length', '%s' % len(content))])
 
+    def test_handle__compact_json(self):
+        result_class = rpc_result_class(descriptors.list0(TestMessage.descriptor))
+        handler = lambda request: (True, result_class([TestMessage('Привет', True, 1)]))
+        start_response = Mock()
+
+        content = wsgi_app(handler)(self.env(), start_response)[0]
+        assert content == '{"data":[{"string0":"Привет","bool0":true,"int0":1}]}'.encode('utf-8')
+
+        content = wsgi_app(handler, indent=2)(self.env(), start_response)[0]
+        assert json.loads(content.decode('utf-8')) == {
+            'data': [{'string0': 'Привет', 'bool0': True, 'int0': 1}]}
+        assert b'\n  ' in content
+
+    def test_handle__stream(self):
+        messages = [TestMessage('Привет', True, i) for i in range(1000)]
+        result_class = rpc_result_class(descriptors.list0(TestMessage.descriptor))
+        handler = lambda request: (True, result_class(messages))
+        start_response = Mock()
+
+        app = WsgiRpcApp(handler, stream_threshold=1024)
+        body = app(self.env(), start_response)
+        assert not isinstance(body, list)
+        start_response.assert_called_with('200 OK',
+                                          [('Content-Type', 'application/json; charset=utf-8')])
+
+        content = b''.join(body).decode('utf-8')
+        expected = pdef.jsonformat.write_bytes(result_class(messages), result_class.descriptor,
+                                               compact=True).decode('utf-8')
+        assert json.loads(content) == json.loads(expected)
+        assert len(content) == len(expected)
+
+    def test_handle__stream_below_threshold(self):
+        result_class = rpc_result_class(descriptors.list0(descriptors.int32))
+        handler = lambda request: (True, result_class([1, 2, 3]))
+        start_response = Mock()
+
+        content = WsgiRpcApp(handler, stream_threshold=1024)(self.env(), start_response)
+        assert content == [b'{"data":[1,2,3]}']
+        start_response.assert_called_with('200 OK',
+                                          [('Content-Type', 'application/json; charset=utf-8'),
+                                           ('Content-Length', '16')])
+
     def test_handle__rpc_exc(self):
         def handler(request):
             raise RpcException(http_codes.NOT_FOUND, 'Method not found')
@@ -298,6 +595,53 @@ class TestWsgiRpcServer(unittest.TestCase):
                                           [('Content-Type', 'text/plain; charset=utf-8'),
                                            ('Content-Length', '%s' % len(content))])
 
+    def batch_env(self, body, path='/'):
+        body = body.encode('utf-8')
+        return {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': 'application/json; charset=utf-8',
+            'CONTENT_LENGTH': str(len(body)),
+            'PATH_INFO': path,
+            'wsgi.input': BytesIO(body),
+        }
+
+    def test_handle_batch(self):
+        result_class = rpc_result_class(descriptors.int32)
+
+        def handler(request):
+            if request.path == '/method':
+                return True, result_class(int(request.query['arg0']))
+            if request.path == '/error':
+                raise ValueError('Unexpected')
+            raise RpcException(http_codes.BAD_REQUEST, 'Method not found')
+
+        body = json.dumps([{'path': '/method', 'query': {'arg0': '1'}},
+                           {'path': '/wrong'},
+                           {'path': '/error'},
+                           {'path': '/method', 'query': {'arg0': '2'}}])
+        start_response = Mock()
+        content = wsgi_app(handler)(self.batch_env(body), start_response)[0]
+
+        assert json.loads(content.decode(UTF8)) == [
+            {'status': 200, 'data': 1},
+            {'status': 400, 'message': 'Method not found'},
+            {'status': 500, 'message': 'Internal server error'},
+            {'status': 200, 'data': 2}]
+        assert start_response.call_args[0][0] == '200 OK'
+
+    def test_handle_batch__malformed(self):
+        start_response = Mock()
+        wsgi_app(Mock())(self.batch_env('{"path": "/method"}'), start_response)
+
+        assert start_response.call_args[0][0] == '400 Bad Request'
+
+    def test_handle_batch__too_large(self):
+        start_response = Mock()
+        app = WsgiRpcApp(Mock(), max_batch_size=1)
+        app(self.batch_env('[{"path": "/a"}, {"path": "/b"}]'), start_response)
+
+        assert start_response.call_args[0][0].startswith('413 ')
+
     def test_parse_request(self):
         query = urlencode('привет=мир', '=')
         body = urlencode('пока=мир', '=')
@@ -345,6 +689,105 @@ class TestIntegration(unittest.TestCase):
     def tearDown(self):
         self.server.shutdown()
 
+    @unittest.skipIf(futures is None, 'requires concurrent.futures')
+    def test_map(self):
+        url = 'http://localhost:%s' % self.server.server_port
+        client = rpc_client(TestSubInterface, url)
+        proxy = pdef.proxy(TestSubInterface, lambda invocation: invocation)
+
+        self.service.method = Mock(side_effect=lambda arg0, arg1: arg0 + arg1)
+        self.service.exc0 = Mock(side_effect=TestException('Test exception'))
+        self.service.void0 = Mock(return_value=None)
+
+        invocations = [proxy.method(i, i) for i in range(10)]
+        invocations.insert(5, proxy.exc0())
+        invocations.append(proxy.void0())
+        results = client.map(invocations, max_workers=4)
+
+        assert len(results) == 12
+        assert [r.data for r in results[:5]] == [0, 2, 4, 6, 8]
+        assert results[5].error == TestException('Test exception')
+        assert not results[5].has_data
+        assert [r.data for r in results[6:11]] == [10, 12, 14, 16, 18]
+        assert results[11].data is None
+
+    @unittest.skipIf(futures is None, 'requires concurrent.futures')
+    def test_map__server_error(self):
+        url = 'http://localhost:%s' % self.server.server_port
+        client = rpc_client(TestSubInterface, url)
+        proxy = pdef.proxy(TestSubInterface, lambda invocation: invocation)
+
+        self.service.method = Mock(return_value=1)
+        self.service.serverError = Mock(side_effect=ValueError('Test exception'))
+
+        invocations = [proxy.method(1, 2), proxy.serverError()]
+        self.assertRaises(RpcException, client.map, invocations)
+
+    def test_batch(self):
+        url = 'http://localhost:%s' % self.server.server_port
+        client = rpc_client(TestSubInterface, url)
+        proxy = pdef.proxy(TestSubInterface, lambda invocation: invocation)
+
+        self.service.method = Mock(side_effect=lambda arg0, arg1: arg0 + arg1)
+        self.service.post = Mock(return_value=11)
+        self.service.exc0 = Mock(side_effect=TestException('Test exception'))
+        self.service.interface0 = Mock(return_value=self.service)
+
+        results = client.batch([proxy.method(1, 2), proxy.exc0(), proxy.post(5, 6),
+                                proxy.interface0(1, 2).method(3, 4)])
+
+        assert results[0].data == 3
+        assert results[1].error == TestException('Test exception')
+        assert results[2].data == 11
+        assert results[3].data == 7
+        self.service.post.assert_called_with(arg0=5, arg1=6)
+
+    def test_batch__server_error(self):
+        url = 'http://localhost:%s' % self.server.server_port
+        client = rpc_client(TestSubInterface, url)
+        proxy = pdef.proxy(TestSubInterface, lambda invocation: invocation)
+
+        self.service.method = Mock(return_value=1)
+        self.service.serverError = Mock(side_effect=ValueError('Test exception'))
+
+        try:
+            client.batch([proxy.method(1, 2), proxy.serverError()])
+            self.fail()
+        except RpcException as e:
+            assert e.status == http_codes.INTERNAL_SERVER_ERROR
+
+    def test_batching(self):
+        url = 'http://localhost:%s' % self.server.server_port
+        client = rpc_client(TestSubInterface, url)
+        client._send_batch = Mock(wraps=client._send_batch)
+        batcher = client.batching(window=0.5, max_batch_size=8)
+        proxy = batcher.proxy()
+
+        self.service.method = Mock(side_effect=lambda arg0, arg1: arg0 + arg1)
+        self.service.exc0 = Mock(side_effect=TestException('Test exception'))
+
+        results = {}
+
+        def call(i):
+            try:
+                results[i] = proxy.exc0() if i == 3 else proxy.method(i, i)
+            except TestException as e:
+                results[i] = e
+
+        threads = [Thread(target=call, args=(i, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert client._send_batch.call_count == 1
+        assert results[3] == TestException('Test exception')
+        assert [results[i] for i in range(8) if i != 3] == [0, 2, 4, 8, 10, 12, 14]
+
+        # A single call is sent as a usual request.
+        assert proxy.method(1, 2) == 3
+        assert client._send_batch.call_count == 1
+
     def test(self):
         client = self.client
         service = self.service
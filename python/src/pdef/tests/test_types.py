@@ -105,3 +105,82 @@ class TestPdefMessage(unittest.TestCase):
         assert msg1 == msg0
         assert msg1.list0 is not msg0.list0
         assert msg1.message0 is not msg0.message0
+
+    def test_deepcopy__collections_and_polymorphic(self):
+        msg0 = TestComplexMessage(map0={1: 1.5}, set0={1, 2},
+                                  polymorphic=MultiLevelSubtype(field='field', mfield='mfield'))
+        msg1 = copy.deepcopy(msg0)
+
+        assert msg1 == msg0
+        assert msg1.map0 is not msg0.map0
+        assert msg1.set0 is not msg0.set0
+        assert isinstance(msg1.polymorphic, MultiLevelSubtype)
+        assert msg1.polymorphic is not msg0.polymorphic
+
+    def test_deepcopy__shared_references(self):
+        message = TestMessage('hello')
+        msg0 = TestComplexMessage(message0=message, polymorphic=Base())
+        msgs = copy.deepcopy([msg0, message])
+
+        assert msgs[0].message0 is msgs[1]
+        assert msgs[1] is not message
+
+
+class TestSlotsMessage(unittest.TestCase):
+    def _fixture(self):
+        return Slotted(name='hello', tags=['a'], child=Slotted(name='child'))
+
+    def test_no_dict(self):
+        msg = self._fixture()
+
+        assert not hasattr(msg, '__dict__')
+        assert msg.name == 'hello'
+        assert msg.has_child
+
+    def test_eq(self):
+        assert self._fixture() == self._fixture()
+        assert self._fixture() != Slotted(name='hello')
+
+    def test_copy(self):
+        msg0 = self._fixture()
+        msg1 = copy.copy(msg0)
+        msg2 = copy.deepcopy(msg0)
+
+        assert msg1 == msg0
+        assert msg1.tags is msg0.tags
+        assert msg2 == msg0
+        assert msg2.tags is not msg0.tags
+        assert msg2.child is not msg0.child
+
+    def test_merge(self):
+        msg = Slotted(name='world').merge(Slotted(tags=['b']))
+        assert msg == Slotted(name='world', tags=['b'])
+
+    def test_str(self):
+        assert str(Slotted(name='hello')) == '<Slotted _name=hello, _tags=None, _child=None>'
+
+    def test_json__lazy(self):
+        msg0 = self._fixture()
+        msg1 = Slotted.from_json(msg0.to_json(), lazy=True)
+
+        assert msg1.child.name == 'child'
+        assert msg1 == msg0
+        assert msg1._pdef_lazy is None
+
+
+class Slotted(pdef.Message):
+    __slots__ = ('_name', '_tags', '_child', '_pdef_lazy')
+    _pdef_slots = True
+
+    name = descriptors.field('name', lambda: descriptors.string0)
+    tags = descriptors.field('tags', lambda: descriptors.list0(descriptors.string0))
+    child = descriptors.field('child', lambda: Slotted.descriptor)
+    descriptor = descriptors.message(lambda: Slotted, fields=(name, tags, child))
+
+    has_child = child.has_property
+
+    def __init__(self, name=None, tags=None, child=None):
+        self._pdef_lazy = None
+        self.name = name
+        self.tags = tags
+        self.child = child
@@ -1,6 +1,5 @@
 # encoding: utf-8
 from __future__ import unicode_literals
-import copy
 import sys
 import pdef
 
@@ -46,7 +45,11 @@ class Interface(object):
 
 
 class Message(object):
+    '''Base message, subclasses can store fields in __slots__ and set _pdef_slots to True.'''
+    __slots__ = ()
     descriptor = None
+    _pdef_lazy = None  # Not yet decoded fields, see JsonFormat.read(lazy=True).
+    _pdef_slots = False
 
     @classmethod
     def from_json(cls, s, **kwargs):
@@ -59,9 +62,14 @@ class Message(object):
         return pdef.jsonformat.read_stream(fp, cls.descriptor, **kwargs)
 
     @classmethod
-    def from_dict(cls, d):
+    def from_bytes(cls, s):
+        '''Parse a message from bytes in the binary format.'''
+        return pdef.binaryformat.read(s, cls.descriptor)
+
+    @classmethod
+    def from_dict(cls, d, **kwargs):
         '''Parse a message from a dictionary.'''
-        return pdef.jsonformat.read_object(d, cls.descriptor)
+        return pdef.jsonformat.read_object(d, cls.descriptor, **kwargs)
 
     def to_json(self, indent=None, **kwargs):
         '''Convert this message to a json string.'''
@@ -71,6 +79,14 @@ class Message(object):
         '''Serialize this message as a json string to a file-like stream.'''
         return pdef.jsonformat.write_to_stream(self, self.descriptor, fp, indent=indent, **kwargs)
 
+    def iter_json(self, indent=None):
+        '''Return a generator which incrementally encodes this message into json text chunks.'''
+        return pdef.jsonformat.iter_json(self, self.descriptor, indent=indent)
+
+    def to_bytes(self):
+        '''Serialize this message to bytes in the binary format.'''
+        return pdef.binaryformat.write(self, self.descriptor)
+
     def to_dict(self):
         '''Convert this message to a dictionary (serialize each field).'''
         return pdef.jsonformat.write_object(self, self.descriptor)
@@ -86,6 +102,7 @@ class Message(object):
                 return
             descriptor = message.descriptor
 
+        message._decode_lazy()
         for field in descriptor.fields:
             if field.is_discriminator:
                 continue
@@ -94,7 +111,7 @@ class Message(object):
             if value is None:
                 continue
 
-            value_copy = copy.deepcopy(value)
+            value_copy = field.type.deepcopy(value)
             setattr(self, field.name, value_copy)
 
         return self
@@ -117,21 +134,64 @@ class Message(object):
     def __eq__(self, other):
         if other is None or self.__class__ is not other.__class__:
             return False
-        return self.__dict__ == other.__dict__
+
+        self._decode_lazy()
+        other._decode_lazy()
+        if not self._pdef_slots:
+            return self.__dict__ == other.__dict__
+
+        for _, private_name, _ in self.descriptor.field_tuples:
+            if getattr(self, private_name) != getattr(other, private_name):
+                return False
+        return True
 
     def __ne__(self, other):
         return not self == other
 
     def __copy__(self):
-        msg = self.__class__()
-        msg.__dict__ = copy.copy(self.__dict__)
+        self._decode_lazy()
+        msg = self.__class__.__new__(self.__class__)
+        self._copy_to(msg)
         return msg
 
     def __deepcopy__(self, memo=None):
-        msg = self.__class__()
-        msg.__dict__ = copy.deepcopy(self.__dict__, memo)
+        '''Deep copy collection and message fields, other values are immutable
+        and are copied by reference.'''
+        if memo is None:
+            memo = {}
+        else:
+            msg = memo.get(id(self))
+            if msg is not None:
+                return msg
+
+        self._decode_lazy()
+        msg = self.__class__.__new__(self.__class__)
+        memo[id(self)] = msg
+
+        self._copy_to(msg)
+        for private_name, type0 in self.descriptor.mutable_field_tuples:
+            value = getattr(msg, private_name)
+            if value is not None:
+                setattr(msg, private_name, type0.deepcopy(value, memo))
         return msg
 
+    def _copy_to(self, msg):
+        '''Copy field values and instance attributes by reference into a new message.'''
+        if self._pdef_slots:
+            msg._pdef_lazy = None
+            for _, private_name, _ in self.descriptor.field_tuples:
+                setattr(msg, private_name, getattr(self, private_name))
+
+        d = getattr(self, '__dict__', None)
+        if d:
+            msg.__dict__.update(d)
+
+    def _decode_lazy(self):
+        '''Decode all lazily parsed fields.'''
+        lazy = self._pdef_lazy
+        if lazy is not None:
+            lazy.decode_all(self)
+
     def __str__(self):
         s = self.__unicode__()
         if sys.version < '3':
@@ -145,8 +205,14 @@ class Message(object):
             to_unicode = unicode
 
         first = True
-        d = self.__dict__
-        for key, value in d.items():
+        self._decode_lazy()
+        if self._pdef_slots:
+            items = [(private_name, getattr(self, private_name))
+                     for _, private_name, _ in self.descriptor.field_tuples]
+        else:
+            items = self.__dict__.items()
+
+        for key, value in items:
             if first:
                 first = False
             else: